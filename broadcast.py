@@ -0,0 +1,183 @@
+import asyncio
+import logging
+
+from aiohttp import ClientError
+from aiogram import Bot
+from aiogram.utils.exceptions import (
+    RetryAfter, Unauthorized, ChatNotFound, TelegramAPIError, MessageNotModified
+)
+
+from tenants import current_tenant
+from database import (
+    get_active_broadcasts, set_broadcast_status, get_registrations_page,
+    add_broadcast_recipients, get_pending_deliveries, save_delivery_results,
+    count_retryable_deliveries, fail_pending_deliveries, get_broadcast_counts, Broadcast
+)
+
+# -----------------------------
+# НАСТРОЙКИ РАССЫЛКИ
+# -----------------------------
+# Telegram допускает ~30 сообщений/с на бота; оставляем запас под обычные ответы пользователям.
+SEND_RATE = 20          # сообщений в секунду
+BATCH_SIZE = 50         # получателей за одну выборку курсором
+MAX_ATTEMPTS = 3        # попыток на одного получателя
+RETRY_DELAY = 30        # сек. перед первым повтором, далее x2
+PROGRESS_EVERY = 5      # сек. между обновлениями прогресса у админа
+IDLE_POLL = 60          # сек. между проверками очереди без сигнала
+RETRY_POLL = 5          # сек. между проверками, пока задания ждут повторов
+
+class RateLimiter:
+    """Равномерно разносит вызовы: не больше rate в секунду на все задачи сразу."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            wait = self._next - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next = max(loop.time(), self._next) + self.interval
+
+    def pause(self, seconds: float):
+        """Притормозить все отправки (после RetryAfter от Telegram)."""
+        loop = asyncio.get_running_loop()
+        self._next = max(self._next, loop.time() + seconds)
+
+limiter = RateLimiter(SEND_RATE)
+_wakeups = {}  # имя заведения (None — режим одного бота) -> asyncio.Event его отправщика
+
+def notify_new_broadcast():
+    """Разбудить отправщика текущего заведения сразу после постановки задания в очередь."""
+    tenant = current_tenant.get()
+    wakeup = _wakeups.get(tenant.name if tenant else None)
+    if wakeup is not None:
+        wakeup.set()
+
+def progress_text(broadcast_id: int, counts: dict, done: bool = False) -> str:
+    head = "✅ Рассылка завершена" if done else "📣 Рассылка идёт"
+    return (
+        f"{head} (#{broadcast_id}):\n"
+        f"• Доставлено: {counts['sent']}\n"
+        f"• Заблокировали бота: {counts['blocked']}\n"
+        f"• Ошибки: {counts['failed']}\n"
+        f"• В очереди: {counts['pending']}"
+    )
+
+async def _deliver(bot: Bot, user_id: int, text: str):
+    """Одна отправка. Возвращает (user_id, status, error); status='pending' — нужен повтор."""
+    while True:
+        await limiter.acquire()
+        try:
+            await bot.send_message(user_id, text)
+            return user_id, 'sent', None
+        except RetryAfter as e:
+            # флуд-контроль: тормозим весь поток и пробуем снова, попытку не считаем
+            limiter.pause(e.timeout)
+        except (Unauthorized, ChatNotFound) as e:
+            return user_id, 'blocked', str(e)
+        except (TelegramAPIError, ClientError, asyncio.TimeoutError) as e:
+            return user_id, 'pending', str(e) or e.__class__.__name__
+
+async def _send_pending(bot: Bot, job: Broadcast) -> int:
+    """Отправить порцию получателей, чья попытка уже подошла. Возвращает размер порции."""
+    user_ids = await get_pending_deliveries(job.id, MAX_ATTEMPTS, BATCH_SIZE)
+    if user_ids:
+        results = await asyncio.gather(*(_deliver(bot, uid, job.text) for uid in user_ids))
+        await save_delivery_results(job.id, results, RETRY_DELAY)
+    return len(user_ids)
+
+class _Progress:
+    """Сообщение админу с прогрессом, обновляется не чаще PROGRESS_EVERY секунд."""
+
+    def __init__(self, bot: Bot, admin_id: int, broadcast_id: int):
+        self.bot = bot
+        self.admin_id = admin_id
+        self.broadcast_id = broadcast_id
+        self.message_id = None
+        self.last = 0.0
+
+    async def update(self, done: bool = False):
+        loop = asyncio.get_running_loop()
+        if not done and loop.time() - self.last < PROGRESS_EVERY:
+            return
+        self.last = loop.time()
+        text = progress_text(self.broadcast_id, await get_broadcast_counts(self.broadcast_id), done)
+        try:
+            # только self.bot: у фоновой задачи нет «текущего» бота, а у заведений он свой
+            if self.message_id is None:
+                self.message_id = (await self.bot.send_message(self.admin_id, text)).message_id
+            else:
+                await self.bot.edit_message_text(text, self.admin_id, self.message_id)
+        except MessageNotModified:
+            pass
+        except Exception as e:
+            logging.warning(f"Не удалось обновить прогресс рассылки #{self.broadcast_id}: {e}")
+
+async def broadcast_step(bot: Bot, job: Broadcast, progress: _Progress) -> bool:
+    """
+    Один шаг задания: поставить в outbox следующую порцию получателей (курсор
+    сохраняется в БД) и отправить порцию тех, чья попытка подошла. Повторы ждут
+    next_attempt_at в outbox, а не в sleep, поэтому не задерживают другие задания.
+    Возвращает True, если шаг что-то сделал.
+    """
+    busy = False
+    exhausted = job.status == 'retrying'
+    if not exhausted:
+        page = await get_registrations_page(job.event_id, job.cursor, BATCH_SIZE)
+        if page:
+            await add_broadcast_recipients(job.id, [uid for _, uid in page], page[-1][0])
+            busy = True
+        else:
+            await set_broadcast_status(job.id, 'retrying')
+            exhausted = True
+
+    if await _send_pending(bot, job):
+        await progress.update()
+        return True
+    if exhausted and not await count_retryable_deliveries(job.id, MAX_ATTEMPTS):
+        await fail_pending_deliveries(job.id)
+        await set_broadcast_status(job.id, 'done')
+        await progress.update(done=True)
+        return True
+    return busy
+
+async def broadcast_sender(bot: Bot, tenant=None):
+    """
+    Фоновый отправщик заведения (tenant=None — режим одного бота). За проход —
+    по одному шагу каждого активного задания, поэтому новое срочное задание не ждёт
+    окончания старых. Всё состояние в outbox — отправщик переживает рестарты.
+    """
+    if tenant is not None:
+        current_tenant.set(tenant)  # контекст задачи — копия, другим задачам не виден
+    wakeup = _wakeups.setdefault(tenant.name if tenant else None, asyncio.Event())
+    progress = {}  # broadcast_id -> _Progress
+    while True:
+        jobs = []
+        busy = False
+        try:
+            jobs = await get_active_broadcasts()
+            progress = {job.id: progress.get(job.id) or _Progress(bot, job.admin_id, job.id) for job in jobs}
+            for job in jobs:
+                busy = await broadcast_step(bot, job, progress[job.id]) or busy
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.exception(f"Ошибка отправщика рассылок: {e}")
+        if busy:
+            continue
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=RETRY_POLL if jobs else IDLE_POLL)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+
+async def broadcast_scheduler(targets):
+    """
+    Рассылки нескольких ботов: targets — список (tenant, bot). У каждого заведения
+    свой отправщик, лимитер общий — очереди заведений не ждут друг друга.
+    """
+    await asyncio.gather(*(broadcast_sender(bot, tenant) for tenant, bot in targets))
@@ -1,87 +1,363 @@
+import asyncio
+import functools
+import os
+import re
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime
+
 import aiosqlite
 
-DB_PATH = 'registrations.db'
-
-async def init_db():
-    """Инициализация БД и мягкие миграции (seats, open_at)."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys = ON;")
-
-        # События
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                date_time TEXT NOT NULL,
-                place TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Регистрации
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS registrations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                event_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                name TEXT,
-                phone TEXT,
-                ts DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(event_id) REFERENCES events(id) ON DELETE CASCADE
-            )
-        """)
-
-        # --- миграции ---
-        # seats в registrations
-        seats_exists = False
-        async with db.execute("PRAGMA table_info(registrations)") as cur:
-            cols = await cur.fetchall()
-            for c in cols:
-                if c[1] == "seats":
-                    seats_exists = True
-                    break
-        if not seats_exists:
-            await db.execute("ALTER TABLE registrations ADD COLUMN seats INTEGER DEFAULT 1")
-
-        # open_at в events
-        open_exists = False
-        async with db.execute("PRAGMA table_info(events)") as cur:
-            cols = await cur.fetchall()
-            for c in cols:
-                if c[1] == "open_at":
-                    open_exists = True
-                    break
-        if not open_exists:
-            await db.execute("ALTER TABLE events ADD COLUMN open_at TEXT")
-            # старым событиям открываем сразу (open_at = date_time)
-            await db.execute("UPDATE events SET open_at = date_time WHERE open_at IS NULL")
+from tenants import current_tenant
 
-        await db.commit()
+DB_PATH = os.getenv("DB_PATH", 'registrations.db')
+# сколько ждать чужую пишущую транзакцию (миграции, чекпойнт WAL), сек.
+DB_TIMEOUT = 15
+
+# пересчёт reg_count/seats_total из registrations (cancel_count не восстановить — сохраняем)
+STATS_ACTUAL_SQL = (
+    "SELECT event_id, COUNT(*) AS reg_count, SUM(COALESCE(seats, 1)) AS seats_total "
+    "FROM registrations GROUP BY event_id"
+)
+STATS_REBUILD_SQL = (
+    "INSERT INTO event_stats (event_id, reg_count, seats_total) "
+    "SELECT r.event_id, r.reg_count, r.seats_total FROM (" + STATS_ACTUAL_SQL + ") r "
+    "WHERE true "
+    "ON CONFLICT(event_id) DO UPDATE SET "
+    "reg_count = excluded.reg_count, seats_total = excluded.seats_total"
+)
+
+# веса bm25 для колонок events_fts: name, description, place
+FTS_WEIGHTS = (10.0, 1.0, 3.0)
+
+# -----------------------------
+# ЗАПИСИ (строки БД по именам полей)
+# -----------------------------
+# Все выборки событий возвращают одинаковый набор колонок (EVENT_COLUMNS),
+# время разбирается один раз — в row factory.
+EVENT_COLUMNS = (
+    "events.id, events.name, events.description, events.date_time, events.place, events.open_at, "
+    "events.cancelled_at IS NOT NULL"
+)
+# условие «событие видно пользователю» (параметры: now_iso, now_iso)
+VISIBLE_SQL = "date_time >= ? AND (open_at IS NULL OR open_at <= ?) AND cancelled_at IS NULL"
+
+@dataclass(slots=True)
+class Event:
+    id: int
+    name: str
+    description: str
+    date_time: datetime
+    place: str | None
+    open_at: datetime | None   # None — регистрация открыта сразу
+    cancelled: bool
+
+@dataclass(slots=True)
+class Registration:
+    user_id: int
+    name: str | None
+    phone: str | None
+    seats: int
+
+@dataclass(slots=True)
+class EventStats:
+    id: int
+    name: str
+    date_time: datetime
+    reg_count: int
+    seats_total: int
+    cancel_count: int
+
+@dataclass(slots=True)
+class Broadcast:
+    id: int
+    event_id: int
+    admin_id: int
+    text: str
+    cursor: int   # registrations.id последнего получателя, поставленного в outbox
+    status: str   # pending -> running -> retrying (все получатели в outbox) -> done
+
+def _event_row(cursor, row) -> Event:
+    return Event(
+        row[0], row[1], row[2] or '',
+        datetime.fromisoformat(row[3]),
+        row[4],
+        datetime.fromisoformat(row[5]) if row[5] else None,
+        bool(row[6]),
+    )
+
+def _registration_row(cursor, row) -> Registration:
+    return Registration(row[0], row[1], row[2], row[3])
+
+def _stats_row(cursor, row) -> EventStats:
+    return EventStats(row[0], row[1], datetime.fromisoformat(row[2]), row[3], row[4], row[5])
+
+def _broadcast_row(cursor, row) -> Broadcast:
+    return Broadcast(row[0], row[1], row[2], row[3], row[4], row[5])
+
+def db_path() -> str:
+    """Файл БД текущего заведения (или DB_PATH в режиме одного бота)."""
+    tenant = current_tenant.get()
+    return tenant.db_path if tenant else DB_PATH
+
+def connect():
+    """
+    Соединение с БД. Внутри SerialWriter — его долгоживущее соединение, иначе новое:
+    запись ждёт освобождения блокировки вместо 'database is locked'.
+    """
+    db = _writer_conn.get()
+    if db is not None:
+        return _Borrowed(db)
+    return aiosqlite.connect(db_path(), timeout=DB_TIMEOUT)
+
+# -----------------------------
+# ЕДИНСТВЕННЫЙ ПИСАТЕЛЬ (многопроцессный режим, workers.py)
+# -----------------------------
+# Пишущие функции помечены @writes. Обычно они выполняются на месте; если задан
+# write_hook, вызов (имя, args, kwargs) уходит ему — воркеры пересылают его в
+# процесс-писатель, а тот выполняет записи строго по одной (SerialWriter).
+WRITE_FUNCS = {}
+write_hook = None
+_writer_conn: ContextVar = ContextVar('writer_conn', default=None)
+
+def writes(func):
+    WRITE_FUNCS[func.__name__] = func
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if write_hook is not None:
+            return await write_hook(func.__name__, args, kwargs)
+        return await func(*args, **kwargs)
+
+    return wrapper
+
+class _Borrowed:
+    """Соединение писателя на время одной функции: не закрывается, брошенная транзакция откатывается."""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def __aenter__(self):
+        self.db.row_factory = None
+        return self.db
+
+    async def __aexit__(self, *exc):
+        if self.db.in_transaction:
+            await self.db.rollback()
+
+class SerialWriter:
+    """Выполняет пишущие функции по одной на долгоживущем соединении (одно на файл БД)."""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._conns = {}
+
+    async def __call__(self, name: str, args, kwargs):
+        async with self._lock:
+            path = db_path()
+            db = self._conns.get(path)
+            if db is None:
+                db = self._conns[path] = await aiosqlite.connect(path, timeout=DB_TIMEOUT)
+            token = _writer_conn.set(db)
+            try:
+                return await WRITE_FUNCS[name](*args, **kwargs)
+            finally:
+                _writer_conn.reset(token)
+
+    async def close(self):
+        for db in self._conns.values():
+            await db.close()
+        self._conns.clear()
+
+# -----------------------------
+# СХЕМА И МИГРАЦИИ (PRAGMA user_version)
+# -----------------------------
+# Каждая миграция выполняется ровно один раз; номер последней применённой
+# хранится в PRAGMA user_version. Базы, созданные до версионирования
+# (user_version = 0), могут уже содержать часть объектов — поэтому миграции
+# ниже не падают на существующих таблицах/колонках.
 
+async def _column_exists(db, table: str, column: str) -> bool:
+    async with db.execute(f"PRAGMA table_info({table})") as cur:
+        return any(c[1] == column for c in await cur.fetchall())
+
+async def _migrate_base(db):
+    """1: события и регистрации (+ seats, open_at из старых мягких миграций)."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            date_time TEXT NOT NULL,
+            place TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS registrations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            name TEXT,
+            phone TEXT,
+            ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(event_id) REFERENCES events(id) ON DELETE CASCADE
+        )
+    """)
+    if not await _column_exists(db, "registrations", "seats"):
+        await db.execute("ALTER TABLE registrations ADD COLUMN seats INTEGER DEFAULT 1")
+    if not await _column_exists(db, "events", "open_at"):
+        await db.execute("ALTER TABLE events ADD COLUMN open_at TEXT")
+        # старым событиям открываем сразу (open_at = date_time)
+        await db.execute("UPDATE events SET open_at = date_time WHERE open_at IS NULL")
+
+async def _migrate_broadcasts(db):
+    """2: outbox рассылок + индекс для выборки регистраций курсором."""
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_registrations_event ON registrations(event_id, id)"
+    )
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            admin_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            cursor INTEGER NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            PRIMARY KEY (broadcast_id, user_id),
+            FOREIGN KEY(broadcast_id) REFERENCES broadcasts(id) ON DELETE CASCADE
+        )
+    """)
+
+async def _migrate_fts(db):
+    """3: полнотекстовый поиск по событиям (FTS5), rowid = events.id."""
+    await db.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5("
+        "name, description, place, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    await db.execute(
+        "INSERT INTO events_fts (rowid, name, description, place) "
+        "SELECT id, name, COALESCE(description, ''), COALESCE(place, '') FROM events "
+        "WHERE id NOT IN (SELECT rowid FROM events_fts)"
+    )
+
+async def _migrate_event_stats(db):
+    """4: агрегаты по событиям, заполняются из текущих регистраций."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS event_stats (
+            event_id INTEGER PRIMARY KEY,
+            reg_count INTEGER NOT NULL DEFAULT 0,
+            seats_total INTEGER NOT NULL DEFAULT 0,
+            cancel_count INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(event_id) REFERENCES events(id) ON DELETE CASCADE
+        )
+    """)
+    await db.execute(STATS_REBUILD_SQL)
+
+async def _migrate_cancelled(db):
+    """5: отмена мероприятия без удаления (записи сохраняются для уведомления)."""
+    if not await _column_exists(db, "events", "cancelled_at"):
+        await db.execute("ALTER TABLE events ADD COLUMN cancelled_at DATETIME")
+
+async def _migrate_delivery_retry(db):
+    """6: время следующей попытки доставки — повторы ждут в outbox, а не в памяти отправщика."""
+    if not await _column_exists(db, "broadcast_deliveries", "next_attempt_at"):
+        await db.execute("ALTER TABLE broadcast_deliveries ADD COLUMN next_attempt_at DATETIME")
+
+# порядок менять нельзя — только дописывать новые в конец
+MIGRATIONS = [
+    _migrate_base,
+    _migrate_broadcasts,
+    _migrate_fts,
+    _migrate_event_stats,
+    _migrate_cancelled,
+    _migrate_delivery_retry,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+async def init_db() -> int:
+    """
+    Привести схему к SCHEMA_VERSION. Уже мигрированная база проверяется одним
+    чтением user_version; недостающие миграции применяются одной транзакцией.
+    Возвращает версию схемы до запуска.
+    """
+    async with connect() as db:
+        async with db.execute("PRAGMA user_version") as cur:
+            version = (await cur.fetchone())[0]
+        if version >= SCHEMA_VERSION:
+            return version
+
+        # WAL: читатели не блокируют писателя (важно при нескольких воркерах);
+        # режим сохраняется в файле БД, вне транзакции
+        await db.execute("PRAGMA journal_mode = WAL;")
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            # перечитываем под блокировкой: параллельный процесс мог успеть раньше
+            async with db.execute("PRAGMA user_version") as cur:
+                version = (await cur.fetchone())[0]
+            for migration in MIGRATIONS[version:]:
+                await migration(db)
+            await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        return version
+
+@writes
 async def add_registration(event_id: int, user_id: int, name: str, phone: str, seats: int = 1):
     """Добавить новую запись на мероприятие."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect() as db:
         await db.execute(
             "INSERT INTO registrations (event_id, user_id, name, phone, seats) VALUES (?, ?, ?, ?, ?)",
             (event_id, user_id, name, phone, seats)
         )
+        await db.execute(
+            "INSERT INTO event_stats (event_id, reg_count, seats_total) VALUES (?, 1, ?) "
+            "ON CONFLICT(event_id) DO UPDATE SET "
+            "reg_count = reg_count + 1, seats_total = seats_total + excluded.seats_total",
+            (event_id, seats)
+        )
         await db.commit()
 
+async def _insert_event(db, name: str, description: str, date_time: str, place: str,
+                        open_at: str | None) -> int:
+    """INSERT события вместе с индексом FTS (в транзакции вызывающего)."""
+    cursor = await db.execute(
+        "INSERT INTO events (name, description, date_time, place, open_at) VALUES (?, ?, ?, ?, ?)",
+        (name, description, date_time, place, open_at or date_time)
+    )
+    await db.execute(
+        "INSERT INTO events_fts (rowid, name, description, place) VALUES (?, ?, ?, ?)",
+        (cursor.lastrowid, name, description or '', place or '')
+    )
+    return cursor.lastrowid
+
+@writes
 async def create_event(name: str, description: str, date_time: str, place: str, open_at: str | None = None):
     """Добавить новое мероприятие. open_at — время открытия регистрации (если None, открыто сразу)."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO events (name, description, date_time, place, open_at) VALUES (?, ?, ?, ?, ?)",
-            (name, description, date_time, place, open_at or date_time)
-        )
+    async with connect() as db:
+        event_id = await _insert_event(db, name, description, date_time, place, open_at)
         await db.commit()
+        return event_id
 
 async def get_all_events():
     """Список всех мероприятий (для админов)."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect() as db:
+        db.row_factory = _event_row
         cursor = await db.execute(
-            "SELECT id, name, description, date_time, place FROM events "
+            f"SELECT {EVENT_COLUMNS} FROM events "
             "ORDER BY date(date_time), time(date_time)"
         )
         return await cursor.fetchall()
@@ -91,40 +367,61 @@ async def get_visible_events(now_iso: str):
     Список событий, видимых пользователю:
       - событие не в прошлом (date_time >= now_iso)
       - open_at наступил (open_at <= now_iso) или NULL
+      - событие не отменено
     """
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with connect() as db:
+        db.row_factory = _event_row
         cursor = await db.execute(
-            "SELECT id, name, description, date_time, place FROM events "
-            "WHERE date_time >= ? AND (open_at IS NULL OR open_at <= ?) "
+            f"SELECT {EVENT_COLUMNS} FROM events "
+            f"WHERE {VISIBLE_SQL} "
             "ORDER BY date(date_time), time(date_time)",
             (now_iso, now_iso)
         )
         return await cursor.fetchall()
 
 async def get_event_by_id(event_id: int):
-    """Мероприятие по ID (возвращает и open_at шестой колонкой)."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Мероприятие по ID (Event или None)."""
+    async with connect() as db:
+        db.row_factory = _event_row
         cursor = await db.execute(
-            "SELECT id, name, description, date_time, place, open_at FROM events WHERE id = ?",
+            f"SELECT {EVENT_COLUMNS} FROM events WHERE id = ?",
             (event_id,)
         )
         return await cursor.fetchone()
 
-async def delete_event(event_id: int):
-    """Удалить мероприятие по ID."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM events WHERE id = ?", (event_id,))
-        await db.commit()
+def fts_query(text: str) -> str:
+    """Свободный текст -> запрос FTS5: каждое слово как префикс, все слова обязательны."""
+    words = re.findall(r"\w+", text.lower())
+    return " ".join(f'"{w}"*' for w in words)
 
-async def delete_registrations_for_event(event_id: int):
-    """Удалить все регистрации на мероприятие."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM registrations WHERE event_id = ?", (event_id,))
-        await db.commit()
+async def search_events(text: str, now_iso: str | None = None, limit: int = 10):
+    """
+    Полнотекстовый поиск по названию, описанию и месту (по релевантности).
+    Если задан now_iso — только видимые пользователю события (как get_visible_events).
+    """
+    query = fts_query(text)
+    if not query:
+        return []
+    sql = (
+        f"SELECT {EVENT_COLUMNS} FROM events_fts "
+        "JOIN events ON events.id = events_fts.rowid "
+        "WHERE events_fts MATCH ?"
+    )
+    params = [query]
+    if now_iso is not None:
+        sql += f" AND {VISIBLE_SQL}"
+        params += [now_iso, now_iso]
+    sql += " ORDER BY bm25(events_fts, ?, ?, ?), date_time LIMIT ?"
+    params += [*FTS_WEIGHTS, limit]
+    async with connect() as db:
+        db.row_factory = _event_row
+        cursor = await db.execute(sql, params)
+        return await cursor.fetchall()
 
 async def get_registrations_by_event(event_id: int):
-    """Список регистраций для события (user_id, name, phone, seats)."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Список регистраций для события (Registration)."""
+    async with connect() as db:
+        db.row_factory = _registration_row
         cursor = await db.execute(
             "SELECT user_id, name, phone, COALESCE(seats, 1) as seats "
             "FROM registrations WHERE event_id = ?",
@@ -132,11 +429,260 @@ async def get_registrations_by_event(event_id: int):
         )
         return await cursor.fetchall()
 
+@writes
 async def delete_registration(event_id: int, user_id: int):
-    """Удалить одну регистрацию пользователя на мероприятие."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Удалить одну регистрацию пользователя на мероприятие (учитывается как отмена)."""
+    async with connect() as db:
+        # сначала агрегаты по удаляемым строкам, затем само удаление — одна транзакция
+        await db.execute(
+            "UPDATE event_stats SET "
+            "reg_count = reg_count - (SELECT COUNT(*) FROM registrations "
+            "                         WHERE event_id = :e AND user_id = :u), "
+            "seats_total = seats_total - (SELECT COALESCE(SUM(COALESCE(seats, 1)), 0) FROM registrations "
+            "                             WHERE event_id = :e AND user_id = :u), "
+            "cancel_count = cancel_count + (SELECT COUNT(*) FROM registrations "
+            "                               WHERE event_id = :e AND user_id = :u) "
+            "WHERE event_id = :e",
+            {'e': event_id, 'u': user_id}
+        )
         await db.execute(
             "DELETE FROM registrations WHERE event_id = ? AND user_id = ?",
             (event_id, user_id)
         )
-        await db.commit()
\ No newline at end of file
+        await db.commit()
+
+# -----------------------------
+# АГРЕГАТЫ (event_stats)
+# -----------------------------
+async def get_event_stats():
+    """Статистика по всем событиям (EventStats)."""
+    async with connect() as db:
+        db.row_factory = _stats_row
+        cursor = await db.execute(
+            "SELECT e.id, e.name, e.date_time, "
+            "COALESCE(s.reg_count, 0), COALESCE(s.seats_total, 0), COALESCE(s.cancel_count, 0) "
+            "FROM events e LEFT JOIN event_stats s ON s.event_id = e.id "
+            "ORDER BY date(e.date_time), time(e.date_time)"
+        )
+        return await cursor.fetchall()
+
+@writes
+async def check_event_stats(rebuild: bool = False):
+    """
+    Сверить event_stats с registrations.
+    Возвращает расхождения (event_id, (reg_count, seats_total) в таблице, фактические);
+    при rebuild=True пересчитывает таблицу в той же транзакции.
+    """
+    async with connect() as db:
+        cursor = await db.execute("SELECT event_id, reg_count, seats_total FROM event_stats")
+        stored = {row[0]: (row[1], row[2]) for row in await cursor.fetchall()}
+        cursor = await db.execute(STATS_ACTUAL_SQL)
+        actual = {row[0]: (row[1], row[2]) for row in await cursor.fetchall()}
+        diffs = [
+            (ev_id, stored.get(ev_id, (0, 0)), actual.get(ev_id, (0, 0)))
+            for ev_id in sorted(stored.keys() | actual.keys())
+            if stored.get(ev_id, (0, 0)) != actual.get(ev_id, (0, 0))
+        ]
+        if rebuild and diffs:
+            await db.execute(
+                "UPDATE event_stats SET reg_count = 0, seats_total = 0 "
+                "WHERE event_id NOT IN (SELECT event_id FROM registrations)"
+            )
+            await db.execute(STATS_REBUILD_SQL)
+            await db.commit()
+        return diffs
+
+# -----------------------------
+# РАССЫЛКИ (outbox)
+# -----------------------------
+@writes
+async def create_broadcast(event_id: int, admin_id: int, text: str) -> int:
+    """Поставить рассылку участникам события в очередь. Возвращает ID задания."""
+    async with connect() as db:
+        cursor = await db.execute(
+            "INSERT INTO broadcasts (event_id, admin_id, text) VALUES (?, ?, ?)",
+            (event_id, admin_id, text)
+        )
+        await db.commit()
+        return cursor.lastrowid
+
+async def get_active_broadcasts():
+    """Незавершённые задания (Broadcast), старые первыми."""
+    async with connect() as db:
+        db.row_factory = _broadcast_row
+        cursor = await db.execute(
+            "SELECT id, event_id, admin_id, text, cursor, status FROM broadcasts "
+            "WHERE status IN ('pending', 'running', 'retrying') ORDER BY id"
+        )
+        return await cursor.fetchall()
+
+@writes
+async def set_broadcast_status(broadcast_id: int, status: str):
+    """Сменить статус задания; для 'done' проставляется finished_at."""
+    async with connect() as db:
+        await db.execute(
+            "UPDATE broadcasts SET status = ?, "
+            "finished_at = CASE WHEN ? = 'done' THEN CURRENT_TIMESTAMP ELSE finished_at END "
+            "WHERE id = ?",
+            (status, status, broadcast_id)
+        )
+        await db.commit()
+
+async def get_registrations_page(event_id: int, after_id: int, limit: int):
+    """Порция регистраций события по курсору: (registrations.id, user_id) с id > after_id."""
+    async with connect() as db:
+        cursor = await db.execute(
+            "SELECT id, user_id FROM registrations "
+            "WHERE event_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (event_id, after_id, limit)
+        )
+        return await cursor.fetchall()
+
+@writes
+async def add_broadcast_recipients(broadcast_id: int, user_ids, new_cursor: int):
+    """Добавить получателей порции и сдвинуть курсор задания (одной транзакцией)."""
+    async with connect() as db:
+        await db.executemany(
+            "INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, user_id) VALUES (?, ?)",
+            [(broadcast_id, uid) for uid in user_ids]
+        )
+        await db.execute(
+            "UPDATE broadcasts SET cursor = ?, status = 'running' WHERE id = ?",
+            (new_cursor, broadcast_id)
+        )
+        await db.commit()
+
+async def get_pending_deliveries(broadcast_id: int, max_attempts: int, limit: int):
+    """
+    user_id получателей, которым ещё не доставлено, сделано меньше max_attempts попыток
+    и подошло время попытки (next_attempt_at). Сначала — ещё не получавшие ни одной.
+    """
+    async with connect() as db:
+        cursor = await db.execute(
+            "SELECT user_id FROM broadcast_deliveries "
+            "WHERE broadcast_id = ? AND status = 'pending' AND attempts < ? "
+            "AND (next_attempt_at IS NULL OR next_attempt_at <= CURRENT_TIMESTAMP) "
+            "ORDER BY attempts, rowid LIMIT ?",
+            (broadcast_id, max_attempts, limit)
+        )
+        return [row[0] for row in await cursor.fetchall()]
+
+async def count_retryable_deliveries(broadcast_id: int, max_attempts: int) -> int:
+    """Сколько недоставленных ещё ждут повтора (сделано меньше max_attempts попыток)."""
+    async with connect() as db:
+        cursor = await db.execute(
+            "SELECT COUNT(*) FROM broadcast_deliveries "
+            "WHERE broadcast_id = ? AND status = 'pending' AND attempts < ?",
+            (broadcast_id, max_attempts)
+        )
+        return (await cursor.fetchone())[0]
+
+@writes
+async def save_delivery_results(broadcast_id: int, results, retry_delay: int):
+    """
+    Записать результаты отправки порции: results — список (user_id, status, error).
+    Для 'pending' следующая попытка — через retry_delay секунд, далее x2 с каждой попыткой.
+    """
+    async with connect() as db:
+        await db.executemany(
+            "UPDATE broadcast_deliveries SET status = ?, error = ?, attempts = attempts + 1, "
+            "next_attempt_at = CASE WHEN ? = 'pending' "
+            "    THEN datetime('now', '+' || (? << attempts) || ' seconds') END "
+            "WHERE broadcast_id = ? AND user_id = ?",
+            [(status, error, status, retry_delay, broadcast_id, uid) for uid, status, error in results]
+        )
+        await db.commit()
+
+@writes
+async def fail_pending_deliveries(broadcast_id: int):
+    """Пометить оставшихся после всех повторов получателей как 'failed'."""
+    async with connect() as db:
+        await db.execute(
+            "UPDATE broadcast_deliveries SET status = 'failed' "
+            "WHERE broadcast_id = ? AND status = 'pending'",
+            (broadcast_id,)
+        )
+        await db.commit()
+
+async def get_broadcast_counts(broadcast_id: int) -> dict:
+    """Счётчики по статусам доставки: {'pending': n, 'sent': n, 'blocked': n, 'failed': n}."""
+    counts = {'pending': 0, 'sent': 0, 'blocked': 0, 'failed': 0}
+    async with connect() as db:
+        cursor = await db.execute(
+            "SELECT status, COUNT(*) FROM broadcast_deliveries WHERE broadcast_id = ? GROUP BY status",
+            (broadcast_id,)
+        )
+        for status, n in await cursor.fetchall():
+            counts[status] = n
+    return counts
+
+# -----------------------------
+# МАССОВЫЕ ОПЕРАЦИИ АДМИНА (каждая — одна транзакция)
+# -----------------------------
+@writes
+async def delete_events(event_ids) -> int:
+    """Удалить события с регистрациями, индексом и агрегатами. Возвращает число удалённых событий."""
+    params = [(ev_id,) for ev_id in event_ids]
+    async with connect() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        await db.executemany("DELETE FROM registrations WHERE event_id = ?", params)
+        await db.executemany("DELETE FROM event_stats WHERE event_id = ?", params)
+        await db.executemany("DELETE FROM events_fts WHERE rowid = ?", params)
+        cursor = await db.executemany("DELETE FROM events WHERE id = ?", params)
+        await db.commit()
+        return cursor.rowcount
+
+@writes
+async def cancel_events(admin_id: int, texts: dict) -> list:
+    """
+    Отменить события (texts: event_id -> текст уведомления участникам).
+    Событие скрывается от пользователей, регистрации остаются, а в outbox
+    ставится рассылка. Возвращает ID созданных рассылок.
+    """
+    broadcast_ids = []
+    async with connect() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        for event_id, text in texts.items():
+            cursor = await db.execute(
+                "UPDATE events SET cancelled_at = CURRENT_TIMESTAMP WHERE id = ? AND cancelled_at IS NULL",
+                (event_id,)
+            )
+            if not cursor.rowcount:
+                continue
+            cursor = await db.execute(
+                "INSERT INTO broadcasts (event_id, admin_id, text) VALUES (?, ?, ?)",
+                (event_id, admin_id, text)
+            )
+            broadcast_ids.append(cursor.lastrowid)
+        await db.commit()
+    return broadcast_ids
+
+@writes
+async def clone_event(event_id: int, dates) -> list:
+    """
+    Копии события на новые даты: dates — список (date_time, open_at) в формате БД,
+    open_at=None — открыть сразу. Возвращает ID новых событий ([] если исходного нет).
+    """
+    new_ids = []
+    async with connect() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cursor = await db.execute("SELECT name, description, place FROM events WHERE id = ?", (event_id,))
+        src = await cursor.fetchone()
+        if src is None:
+            return []
+        name, description, place = src
+        for date_time, open_at in dates:
+            new_ids.append(await _insert_event(db, name, description, date_time, place, open_at))
+        await db.commit()
+    return new_ids
+
+@writes
+async def import_events(rows) -> list:
+    """Импорт событий: rows — (name, description, date_time, place, open_at). Всё или ничего."""
+    new_ids = []
+    async with connect() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        for name, description, date_time, place, open_at in rows:
+            new_ids.append(await _insert_event(db, name, description, date_time, place, open_at))
+        await db.commit()
+    return new_ids
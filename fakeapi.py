@@ -0,0 +1,59 @@
+import asyncio
+import io
+import itertools
+import time
+from collections import Counter
+
+from aiogram import Bot
+
+class FakeBotAPI:
+    """
+    Подмена Bot API для нагрузочных тестов: запросы не уходят в Telegram,
+    отвечаем минимальными валидными объектами с искусственной задержкой.
+    files — содержимое файлов по file_id для скачивания (по умолчанию пустой файл).
+    """
+
+    def __init__(self, latency: float = 0.0, files: dict | None = None):
+        self.latency = latency
+        self.files = files or {}
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    def install(self, bot: Bot):
+        bot.request = self.request
+        bot.download_file = self.download_file
+
+    async def download_file(self, file_path: str, destination=None, seek: bool = True, **kwargs):
+        """Вместо скачивания с серверов Telegram — содержимое из self.files."""
+        self.calls['downloadFile'] += 1
+        content = self.files.get(file_path.rsplit('/', 1)[-1], b'')
+        if destination is None:
+            destination = io.BytesIO()
+        dest = destination if isinstance(destination, io.IOBase) else open(destination, 'wb')
+        dest.write(content)
+        if seek:
+            dest.seek(0)
+        return dest
+
+    async def request(self, method: str, data: dict | None = None, files=None, **kwargs):
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        data = data or {}
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        if method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'sendDocument'):
+            chat_id = int(data.get('chat_id') or 0)
+            return {
+                'message_id': data.get('message_id') or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': data.get('text', ''),
+            }
+        if method == 'getFile':
+            file_id = str(data.get('file_id'))
+            return {
+                'file_id': file_id, 'file_unique_id': file_id,
+                'file_size': len(self.files.get(file_id, b'')), 'file_path': f'documents/{file_id}',
+            }
+        return True
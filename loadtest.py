@@ -0,0 +1,127 @@
+"""
+Нагрузочный тест многопроцессного режима: синтетические апдейты идут в воркеры
+через ту же липкую маршрутизацию, Bot API подменён (fakeapi), БД — временная копия.
+
+Запуск:  python loadtest.py --max-workers 4 --updates 4000 --users 800 --write-share 0.3
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+USER_ID_BASE = 10 ** 9  # чтобы не пересечься с ID админов
+EVENTS = 5             # событий в тестовой базе
+
+def _update(update_id: int, uid: int, kind: str, payload: str) -> dict:
+    user = {'id': uid, 'is_bot': False, 'first_name': f'U{uid}'}
+    chat = {'id': uid, 'type': 'private'}
+    message = {'message_id': update_id, 'date': 0, 'chat': chat, 'from': user, 'text': payload}
+    if kind == 'msg':
+        return {'update_id': update_id, 'message': message}
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': user, 'chat_instance': str(uid), 'message': message, 'data': payload,
+    }}
+
+def make_updates(count: int, users: int, write_share: float, seed: int = 42) -> list:
+    """
+    Апдейты users пользователей вперемешку. Каждый пользователь проходит сценарии подряд:
+    чтение («список мероприятий» -> карточка) или, с долей write_share, запись
+    (su: -> имя -> места -> телефон) и её отмена (cancel:) — две пишущие транзакции.
+    """
+    from main import BTN_EVENTS, CB_EVENT, CB_SIGNUP, CB_CANCEL_REG
+
+    rng = random.Random(seed)
+    scripts = {}
+    updates = []
+    while len(updates) < count:
+        for n in range(min(users, count - len(updates))):
+            uid = USER_ID_BASE + n
+            if not scripts.get(uid):
+                ev = 1 + rng.randrange(EVENTS)
+                if rng.random() < write_share:
+                    scripts[uid] = [('cb', f'{CB_SIGNUP}:{ev}'), ('msg', f'Гость {n}'), ('msg', '2'),
+                                    ('msg', '+70000000000'), ('cb', f'{CB_CANCEL_REG}:{ev}')]
+                else:
+                    scripts[uid] = [('msg', BTN_EVENTS), ('cb', f'{CB_EVENT}:{ev}')]
+            kind, payload = scripts[uid].pop(0)
+            updates.append(_update(len(updates) + 1, uid, kind, payload))
+    return updates
+
+async def _prepare_db():
+    import database
+    await database.init_db()
+    for n in range(1, EVENTS + 1):
+        await database.create_event(
+            f"Мероприятие {n}", "Описание", f"2099-01-0{n} 19:00", "NORD Coffee Base", "2000-01-01 00:00"
+        )
+
+def measure(workers: int, updates: list, latency: float):
+    """
+    Прогнать апдейты через workers процессов.
+    Возвращает (апдейтов/с, ошибок обработки, длительности записей в БД, сек.).
+    """
+    from workers import start_workers, stop_workers, dispatch
+    import multiprocessing as mp
+
+    done_queue = mp.get_context('spawn').Queue()
+    procs, queues, writer = start_workers(workers, done_queue=done_queue, fake_latency=latency)
+    for _ in range(workers):
+        done_queue.get()  # ('ready', ...) — импорт и запуск не входят в замер
+
+    started = time.perf_counter()
+    for raw in updates:
+        dispatch(raw, queues)
+    for q in queues:
+        q.put(None)
+    processed = failed = 0
+    write_times = []
+    for _ in range(workers):
+        _, _, n, errors, times = done_queue.get()
+        processed += n
+        failed += errors
+        write_times += times
+    elapsed = time.perf_counter() - started
+    stop_workers(procs, [], writer)
+    assert processed == len(updates), f"обработано {processed} из {len(updates)}"
+    return processed / elapsed, failed, write_times
+
+def write_summary(times: list) -> str:
+    """Записи в БД: число, p50/p95/макс (мс). Рост p95/макс с числом воркеров — очередь к процессу-писателю."""
+    if not times:
+        return "записей в БД: 0"
+    ms = sorted(t * 1000 for t in times)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    return f"записей в БД: {len(ms)}, мс p50 {statistics.median(ms):.1f} / p95 {p95:.1f} / макс {ms[-1]:.1f}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест воркеров")
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--updates", type=int, default=4000)
+    parser.add_argument("--users", type=int, default=800)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка фейкового Bot API, сек.")
+    parser.add_argument("--write-share", type=float, default=0.3,
+                        help="доля сценариев «запись + отмена» (остальные — просмотр списка и карточки)")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="nord-loadtest-")
+    os.environ["DB_PATH"] = os.path.join(tmp, "registrations.db")
+    os.environ.setdefault("BOT_TOKEN", "123456:LOADTEST")
+    try:
+        asyncio.run(_prepare_db())
+        updates = make_updates(args.updates, args.users, args.write_share)
+
+        base = None
+        for workers in range(1, args.max_workers + 1):
+            rate, failed, write_times = measure(workers, updates, args.latency)
+            base = base or rate
+            print(f"воркеров: {workers}  апдейтов/с: {rate:8.1f}  ускорение: x{rate / base:.2f}  "
+                  f"ошибок: {failed}  {write_summary(write_times)}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
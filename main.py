@@ -1,5 +1,12 @@
+import time
+STARTED_AT = time.perf_counter()  # замер времени запуска — до всех импортов
+
 import os
+import io
+import csv
+import asyncio
 import logging
+import re
 import html  # для экранирования в HTML
 from datetime import datetime, timezone, timedelta
 
@@ -9,14 +16,23 @@ from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
     ContentType
 )
+from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram.utils import executor
 from dotenv import load_dotenv
 
 from database import (
     init_db, add_registration, create_event, get_all_events, get_event_by_id,
-    delete_event, delete_registrations_for_event, get_registrations_by_event, delete_registration,
-    get_visible_events  # NEW
+    get_registrations_by_event, delete_registration,
+    get_visible_events,  # NEW
+    create_broadcast, search_events, get_event_stats, check_event_stats,
+    delete_events, cancel_events, clone_event, import_events,
+    Event
 )
+from broadcast import broadcast_sender, notify_new_broadcast
+from tenants import current_tenant, TenantState
+from profiler import profile_loop
+
+IMPORTED_AT = time.perf_counter()
 
 # -----------------------------
 # НАСТРОЙКИ / ОКРУЖЕНИЕ
@@ -43,6 +59,26 @@ logging.basicConfig(level=logging.INFO)
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher(bot)
 
+class StartupTimingMiddleware(BaseMiddleware):
+    """Логирует время от запуска процесса до первого обработанного апдейта."""
+
+    def __init__(self):
+        super().__init__()
+        self.first_seen = False
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        if not self.first_seen:
+            self.first_seen = True
+            logging.info(f"Старт: первый апдейт обработан через {time.perf_counter() - STARTED_AT:.3f} с")
+
+dp.middleware.setup(StartupTimingMiddleware())
+
+# запись входящих апдейтов для воспроизведения (replay.py)
+RECORD_UPDATES = os.getenv("RECORD_UPDATES")
+if RECORD_UPDATES:
+    from replay import UpdateRecorderMiddleware
+    dp.middleware.setup(UpdateRecorderMiddleware(RECORD_UPDATES))
+
 # -----------------------------
 # ВРЕМЯ/ФОРМАТЫ (GMT+4)
 # -----------------------------
@@ -50,9 +86,17 @@ ISO_FMT = "%Y-%m-%d %H:%M"   # как хранится в БД
 DISP_FMT = "%H:%M %d.%m"     # как показываем пользователю (без года)
 LOCAL_TZ = timezone(timedelta(hours=4))  # GMT+4
 
+def now_local() -> datetime:
+    """Текущее время в GMT+4 (без tzinfo — как времена событий из БД)."""
+    return datetime.utcnow().replace(tzinfo=timezone.utc).astimezone(LOCAL_TZ).replace(tzinfo=None)
+
 def now_local_iso() -> str:
     """Текущее время в GMT+4 в формате БД (строка)."""
-    return datetime.utcnow().replace(tzinfo=timezone.utc).astimezone(LOCAL_TZ).strftime(ISO_FMT)
+    return now_local().strftime(ISO_FMT)
+
+def dt_to_disp(dt: datetime) -> str:
+    """datetime -> HH:MM DD.MM (без года)"""
+    return dt.strftime(DISP_FMT)
 
 def iso_to_disp(iso_str: str) -> str:
     """YYYY-MM-DD HH:MM -> HH:MM DD.MM (без года)"""
@@ -86,10 +130,13 @@ STEP_EVENT, STEP_NAME, STEP_SEATS, STEP_PHONE = range(4)
 # добавили шаг ADMIN_ADD_OPEN_AT
 ADMIN_ADD_TITLE, ADMIN_ADD_DATETIME, ADMIN_ADD_OPEN_AT, ADMIN_ADD_PLACE, ADMIN_ADD_DESC = range(5)
 ADMIN_DEL_WAIT_ID, ADMIN_DEL_CONFIRM = range(2)
+ADMIN_BC_WAIT_ID, ADMIN_BC_TEXT, ADMIN_BC_CONFIRM = range(3)
 
-user_states = {}    # per-user: запись на событие
-add_states = {}     # per-admin: добавление события
-delete_states = {}  # per-admin: удаление события
+# состояния раздельны по заведениям (tenants.py); в режиме одного бота — обычные dict
+user_states = TenantState()       # per-user: запись на событие
+add_states = TenantState()        # per-admin: добавление события
+delete_states = TenantState()     # per-admin: удаление события
+broadcast_states = TenantState()  # per-admin: рассылка участникам
 
 # -----------------------------
 # КЛАВИАТУРЫ
@@ -101,9 +148,11 @@ def main_menu_kb() -> ReplyKeyboardMarkup:
 
 def admin_menu_kb() -> ReplyKeyboardMarkup:
     kb = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-    kb.add(KeyboardButton("📋 Список участников"))
+    kb.add(KeyboardButton("📋 Список участников"), KeyboardButton("📊 Статистика"))
     kb.add(KeyboardButton("➕ Добавить мероприятие"))
     kb.add(KeyboardButton("❌ Удалить мероприятие"))
+    kb.add(KeyboardButton("📣 Рассылка участникам"))
+    kb.add(KeyboardButton("🗂 Массовые операции"))
     kb.add(KeyboardButton(BTN_BACK), KeyboardButton(BTN_CANCEL))
     return kb
 
@@ -128,16 +177,15 @@ def seats_kb() -> ReplyKeyboardMarkup:
 def events_inline_kb(events) -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup()
     for ev in events:
-        ev_id, name, desc, dt, place = ev
-        title = f"{name} • {iso_to_disp(dt)}"
-        kb.add(InlineKeyboardButton(title, callback_data=f"{CB_EVENT}:{ev_id}"))
+        title = f"{ev.name} • {dt_to_disp(ev.date_time)}"
+        kb.add(InlineKeyboardButton(title, callback_data=f"{CB_EVENT}:{ev.id}"))
     return kb
 
-def details_inline_kb(event_id: int, is_open: bool) -> InlineKeyboardMarkup:
+def details_inline_kb(event_id: int, is_open: bool, cancelled: bool = False) -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup()
-    if is_open:
+    if is_open and not cancelled:
         kb.add(InlineKeyboardButton("✅ Записаться", callback_data=f"{CB_SIGNUP}:{event_id}"))
-    else:
+    elif not cancelled:
         kb.add(InlineKeyboardButton("⏳ Регистрация ещё не открыта", callback_data="noop"))
     kb.add(InlineKeyboardButton("⬅️ К списку", callback_data=CB_EVENT_LIST))
     return kb
@@ -150,6 +198,18 @@ def myregs_back_kb() -> ReplyKeyboardMarkup:
 # -----------------------------
 # HELPERS
 # -----------------------------
+def admin_ids() -> list:
+    """Админы текущего заведения (в режиме одного бота — ADMINS)."""
+    tenant = current_tenant.get()
+    return tenant.admins if tenant else ADMINS
+
+def is_admin(user_id: int) -> bool:
+    return user_id in admin_ids()
+
+def current_bot() -> Bot:
+    """Бот, получивший текущий апдейт (в режиме нескольких заведений их несколько)."""
+    return Bot.get_current(no_error=True) or bot
+
 def esc(s: str) -> str:
     """Экранируем текст для HTML parse_mode."""
     return html.escape(s or "")
@@ -178,13 +238,60 @@ def reset_user_state(user_id: int):
 def reset_admin_states(user_id: int):
     add_states.pop(user_id, None)
     delete_states.pop(user_id, None)
-
-def reg_seats_safe(reg_tuple) -> int:
-    """Достаёт seats из кортежа регистрации (если есть), иначе 1."""
+    broadcast_states.pop(user_id, None)
+
+def event_card_lines(ev: Event) -> list:
+    """Карточка события: название, дата/время, место, описание."""
+    lines = [f"🗓 {ev.name}", f"• Дата/время: {dt_to_disp(ev.date_time)}", f"• Место: {ev.place or '(не указано)'}"]
+    if ev.description:
+        lines.append(f"• Описание: {ev.description}")
+    if ev.cancelled:
+        lines.append("❌ Мероприятие отменено")
+    return lines
+
+def event_details(ev: Event):
+    """Карточка события с кнопками по текущему состоянию: (текст, клавиатура)."""
+    is_open = (ev.open_at is None) or (ev.open_at <= now_local())
+    lines = event_card_lines(ev)
+    if not is_open and not ev.cancelled:
+        lines.append(f"⏳ Регистрация откроется: {dt_to_disp(ev.open_at)} (GMT+4)")
+    return "\n".join(lines), details_inline_kb(ev.id, is_open, ev.cancelled)
+
+def parse_ids(text: str) -> list:
+    """'3, 5 7' -> [3, 5, 7] (без повторов, порядок сохраняется)."""
+    return list(dict.fromkeys(int(x) for x in re.findall(r"\d+", text or "")))
+
+def parse_events_csv(text: str):
+    """
+    CSV с заголовком: name, date_time (обязательно), place, description, open_at.
+    Разделитель «,» или «;», время — YYYY-MM-DD HH:MM (GMT+4). Возвращает (rows, errors).
+    """
     try:
-        return int(reg_tuple[3])
-    except Exception:
-        return 1
+        dialect = csv.Sniffer().sniff(text[:2048], delimiters=",;")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    reader.fieldnames = [(f or "").strip().lower() for f in (reader.fieldnames or [])]
+    missing = {'name', 'date_time'} - set(reader.fieldnames)
+    if missing:
+        return [], [f"нет колонок: {', '.join(sorted(missing))}"]
+
+    rows, errors = [], []
+    for line_no, rec in enumerate(reader, start=2):
+        name = (rec.get('name') or "").strip()
+        dt_text = (rec.get('date_time') or "").strip()
+        open_text = (rec.get('open_at') or "").strip()
+        if not name:
+            errors.append(f"строка {line_no}: пустое название")
+            continue
+        try:
+            dt_iso = datetime.strptime(dt_text, ISO_FMT).strftime(ISO_FMT)
+            open_iso = datetime.strptime(open_text, ISO_FMT).strftime(ISO_FMT) if open_text not in ('', '-') else None
+        except ValueError:
+            errors.append(f"строка {line_no}: неверный формат даты (нужно YYYY-MM-DD HH:MM)")
+            continue
+        rows.append((name, (rec.get('description') or "").strip(), dt_iso, (rec.get('place') or "").strip(), open_iso))
+    return rows, errors
 
 async def show_events_list(target) -> None:
     """
@@ -202,15 +309,27 @@ async def show_events_list(target) -> None:
     upcoming_events = await get_visible_events(now_str)
 
     if not upcoming_events:
-        await bot.send_message(chat_id, "📭 В настоящее время нет доступных мероприятий.", reply_markup=main_menu_kb())
+        await current_bot().send_message(chat_id, "📭 В настоящее время нет доступных мероприятий.", reply_markup=main_menu_kb())
         return
 
     user_states[uid] = {'step': STEP_EVENT, 'events': upcoming_events}
-    await bot.send_message(chat_id, "Выберите мероприятие из списка:", reply_markup=back_cancel_kb())
-    await bot.send_message(chat_id, "События:", reply_markup=events_inline_kb(upcoming_events))
+    await current_bot().send_message(chat_id, "Выберите мероприятие из списка:", reply_markup=back_cancel_kb())
+    await current_bot().send_message(chat_id, "События:", reply_markup=events_inline_kb(upcoming_events))
+
+async def show_search_results(message: types.Message, found) -> None:
+    """Одно совпадение — сразу карточка, несколько — инлайн-список, ноль — подсказка."""
+    if not found:
+        await message.reply("Ничего не найдено. Попробуйте другое слово или выберите мероприятие из списка.")
+        return
+    if len(found) > 1:
+        await message.answer("Нашлось несколько мероприятий:", reply_markup=events_inline_kb(found))
+        return
+    text, kb = event_details(found[0])
+    await message.answer(text, reply_markup=kb)
 
 # -----------------------------
-# КОМАНДЫ: /start, /help, /whoami, /admin
+# КОМАНДЫ: /start, /help, /whoami, /admin, /profile, /search, /stats_check,
+#          /delete_events, /cancel_events, /clone_event
 # -----------------------------
 @dp.message_handler(commands=['start', 'help'])
 async def cmd_start(message: types.Message):
@@ -230,11 +349,107 @@ async def whoami(message: types.Message):
 
 @dp.message_handler(commands=['admin'])
 async def cmd_admin(message: types.Message):
-    if message.from_user.id not in ADMINS:
+    if not is_admin(message.from_user.id):
         return await message.reply("Эта команда доступна только администраторам.")
     reset_admin_states(message.from_user.id)
     await message.answer("Режим администрирования:\nВыберите действие.", reply_markup=admin_menu_kb())
 
+@dp.message_handler(commands=['profile'])
+async def cmd_profile(message: types.Message):
+    """/profile [секунды] — сэмплирующий профиль event loop в формате collapsed stacks."""
+    if not is_admin(message.from_user.id):
+        return await message.reply("Эта команда доступна только администраторам.")
+    args = message.get_args().strip()
+    seconds = int(args) if args.isdigit() else 10
+    seconds = max(1, min(seconds, 120))
+
+    await message.reply(f"⏱ Профилирую {seconds} с...")
+    result = await profile_loop(seconds)
+    if result is None:
+        return await message.reply("Профилирование уже идёт, дождитесь результата.")
+    profiler, slow = result
+
+    caption = [f"Снимков: {profiler.samples} за {seconds} с, медленных колбэков: {len(slow)}"]
+    caption += [f"{share:.0%} {name}" for name, share in profiler.hot_spots()]
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    await message.answer_document(
+        types.InputFile(io.BytesIO(profiler.folded().encode("utf-8")), filename=f"profile-{stamp}.folded"),
+        caption="\n".join(caption)[:1000]
+    )
+    if slow:
+        await send_lines_html(message, ["<b>Медленные колбэки asyncio:</b>"] + [f"• {esc(s)}" for s in slow[:30]])
+
+@dp.message_handler(commands=['search'])
+async def cmd_search(message: types.Message):
+    query = message.get_args().strip()
+    if not query:
+        return await message.reply("Напишите, что ищем: /search <название, место или слово из описания>")
+    await show_search_results(message, await search_events(query, now_local_iso()))
+
+@dp.message_handler(commands=['stats_check'])
+async def cmd_stats_check(message: types.Message):
+    """Сверка event_stats с регистрациями; при расхождениях — пересчёт."""
+    if not is_admin(message.from_user.id):
+        return await message.reply("Эта команда доступна только администраторам.")
+    diffs = await check_event_stats(rebuild=True)
+    if not diffs:
+        return await message.answer("✅ Статистика согласована с регистрациями.")
+    lines = [f"⚠️ Расхождений: {len(diffs)}, таблица пересчитана."]
+    for ev_id, (reg_old, seats_old), (reg_new, seats_new) in diffs:
+        lines.append(f"• ID {ev_id}: записей {reg_old} → {reg_new}, мест {seats_old} → {seats_new}")
+    await send_lines_html(message, lines)
+
+@dp.message_handler(commands=['delete_events', 'cancel_events'])
+async def cmd_bulk_delete(message: types.Message):
+    """Удаление/отмена нескольких мероприятий — с подтверждением, одной транзакцией."""
+    if not is_admin(message.from_user.id):
+        return await message.reply("Эта команда доступна только администраторам.")
+    action = 'cancel' if message.get_command(pure=True) == 'cancel_events' else 'delete'
+    ids = parse_ids(message.get_args())
+    if not ids:
+        return await message.reply(f"Укажите ID мероприятий: /{message.get_command(pure=True)} 3 5 7")
+
+    found = {ev.id: ev for ev in await get_all_events()}
+    events = [found[i] for i in ids if i in found]
+    unknown = [str(i) for i in ids if i not in found]
+    if not events:
+        return await message.reply("Мероприятия с такими ID не найдены.")
+
+    reset_admin_states(message.from_user.id)
+    delete_states[message.from_user.id] = {'step': ADMIN_DEL_CONFIRM, 'action': action, 'events': events}
+    verb = "Отменить (участники получат уведомление)" if action == 'cancel' else "Удалить вместе с записями"
+    lines = [f"⚠️ {verb}:"]
+    lines += [f"{ev.id}. {ev.name} ({dt_to_disp(ev.date_time)})" for ev in events]
+    if unknown:
+        lines.append(f"Не найдены: {', '.join(unknown)}")
+    lines.append("Введите ДА для подтверждения или любой другой текст для отмены.")
+    await message.answer("\n".join(lines), reply_markup=back_cancel_kb())
+
+@dp.message_handler(commands=['clone_event'])
+async def cmd_clone_event(message: types.Message):
+    """/clone_event <ID> <YYYY-MM-DD HH:MM>[; <YYYY-MM-DD HH:MM> ...]"""
+    if not is_admin(message.from_user.id):
+        return await message.reply("Эта команда доступна только администраторам.")
+    m = re.match(r"\s*(\d+)\s+(.+)", message.get_args() or "", re.S)
+    if not m:
+        return await message.reply("Формат: /clone_event <ID> <YYYY-MM-DD HH:MM>; <YYYY-MM-DD HH:MM> ...")
+
+    ev = await get_event_by_id(int(m.group(1)))
+    if not ev:
+        return await message.reply("Событие с таким ID не найдено.")
+    try:
+        new_dts = [datetime.strptime(part.strip(), ISO_FMT) for part in re.split(r"[;\n]", m.group(2)) if part.strip()]
+    except ValueError:
+        return await message.reply("❗ Неверный формат даты. Используйте YYYY-MM-DD HH:MM (GMT+4).")
+
+    # регистрация открывается с тем же опережением, что и у исходного события
+    lead = ev.date_time - ev.open_at if ev.open_at else None
+    dates = [(dt.strftime(ISO_FMT), (dt - lead).strftime(ISO_FMT) if lead is not None else None) for dt in new_dts]
+    new_ids = await clone_event(ev.id, dates)
+    lines = [f"✅ \"{ev.name}\" скопировано ({len(new_ids)}):"]
+    lines += [f"{new_id}. {dt_to_disp(dt)}" for new_id, dt in zip(new_ids, new_dts)]
+    await message.answer("\n".join(lines), reply_markup=admin_menu_kb())
+
 # -----------------------------
 # ПОЛЬЗОВАТЕЛЬСКИЙ ФЛОУ
 # -----------------------------
@@ -246,9 +461,9 @@ async def user_list_events(message: types.Message):
 async def go_back(message: types.Message):
     uid = message.from_user.id
     # если админ в подшаге — вернём админ-меню
-    if uid in add_states or uid in delete_states:
+    if uid in add_states or uid in delete_states or uid in broadcast_states:
         reset_admin_states(uid)
-        if uid in ADMINS:
+        if is_admin(uid):
             return await message.answer("Режим администрирования:\nВыберите действие.", reply_markup=admin_menu_kb())
 
     st = user_states.get(uid)
@@ -261,11 +476,11 @@ async def cancel_everything(message: types.Message):
     reset_user_state(message.from_user.id)
     reset_admin_states(message.from_user.id)
     # если это админ — после отмены тоже вернём в админ-меню
-    if message.from_user.id in ADMINS:
+    if is_admin(message.from_user.id):
         return await message.answer("Действие отменено. Вы в админ-меню.", reply_markup=admin_menu_kb())
     await message.answer("Действие отменено. Что дальше?", reply_markup=main_menu_kb())
 
-# Fallback: пользователь ввел название вручную
+# Fallback: пользователь ввел ID или текст вручную — ищем по FTS
 @dp.message_handler(lambda m: user_states.get(m.from_user.id, {}).get('step') == STEP_EVENT)
 async def choose_event_fallback(message: types.Message):
     if message.text in (BTN_BACK, BTN_CANCEL):
@@ -275,20 +490,16 @@ async def choose_event_fallback(message: types.Message):
     if not events_list:
         return await show_events_list(message.chat.id)
 
-    chosen_event = None
-    for ev in events_list:
-        ev_id, ev_name, _, _, _ = ev
-        if message.text.strip().lower() == ev_name.lower() or message.text.strip().startswith(str(ev_id)):
-            chosen_event = ev
-            break
-    if not chosen_event:
-        return await message.reply("Пожалуйста, выберите мероприятие из списка кнопок.")
-
-    ev_id, ev_name, ev_desc, ev_dt, ev_place = chosen_event
-    lines = [f"🗓 {ev_name}", f"• Дата/время: {iso_to_disp(ev_dt)}", f"• Место: {ev_place or '(не указано)'}"]
-    if ev_desc:
-        lines.append(f"• Описание: {ev_desc}")
-    await message.answer("\n".join(lines), reply_markup=details_inline_kb(ev_id, True))  # True — эти события уже открыты
+    text = (message.text or "").strip()
+    # "3" или "3. Название" — выбор по ID из показанного списка; список мог устареть
+    # (админ удалил/отменил событие, в т.ч. в другом воркере) — перечитываем из БД
+    m = re.match(r"(\d+)\b", text)
+    if m and any(ev.id == int(m.group(1)) for ev in events_list):
+        ev = await get_event_by_id(int(m.group(1)))
+        if ev and not ev.cancelled:
+            return await show_search_results(message, [ev])
+
+    await show_search_results(message, await search_events(text, now_local_iso()))
 
 # Инлайн: карточка события
 @dp.callback_query_handler(lambda c: c.data and c.data.startswith(f"{CB_EVENT}:"))
@@ -302,20 +513,8 @@ async def show_event_details_cb(call: types.CallbackQuery):
     if not ev:
         return await call.answer("Событие не найдено.", show_alert=True)
 
-    # id, name, description, date_time, place, open_at
-    ev_id, ev_name, ev_desc, ev_dt, ev_place = ev[:5]
-    open_at = ev[5] if len(ev) > 5 else None
-
-    now_str = now_local_iso()
-    is_open = (open_at is None) or (open_at <= now_str)
-
-    lines = [f"🗓 {ev_name}", f"• Дата/время: {iso_to_disp(ev_dt)}", f"• Место: {ev_place or '(не указано)'}"]
-    if ev_desc:
-        lines.append(f"• Описание: {ev_desc}")
-    if not is_open and open_at:
-        lines.append(f"⏳ Регистрация откроется: {iso_to_disp(open_at)} (GMT+4)")
-
-    await call.message.answer("\n".join(lines), reply_markup=details_inline_kb(ev_id, is_open))
+    text, kb = event_details(ev)
+    await call.message.answer(text, reply_markup=kb)
     await call.answer()
 
 @dp.callback_query_handler(lambda c: c.data == "noop")
@@ -334,17 +533,17 @@ async def signup_cb(call: types.CallbackQuery):
     if not ev:
         return await call.answer("Событие не найдено.", show_alert=True)
 
-    open_at = ev[5] if len(ev) > 5 else None
-    if open_at and open_at > now_local_iso():
+    if ev.cancelled:
+        return await call.answer("Мероприятие отменено.", show_alert=True)
+    if ev.open_at and ev.open_at > now_local():
         return await call.answer("Регистрация на это мероприятие ещё не открыта.", show_alert=True)
 
     regs = await get_registrations_by_event(event_id)
-    if any(reg[0] == call.from_user.id for reg in regs):
+    if any(reg.user_id == call.from_user.id for reg in regs):
         return await call.answer("Вы уже записаны на это мероприятие.", show_alert=True)
 
-    ev_id, ev_name, ev_desc, ev_dt, ev_place = ev[:5]
-    user_states[call.from_user.id] = {'step': STEP_NAME, 'event_id': ev_id, 'event_name': ev_name}
-    await call.message.answer(f"Отлично! Вы выбрали: \"{ev_name}\"\nКак вас зовут?", reply_markup=back_cancel_kb())
+    user_states[call.from_user.id] = {'step': STEP_NAME, 'event_id': ev.id, 'event_name': ev.name}
+    await call.message.answer(f"Отлично! Вы выбрали: \"{ev.name}\"\nКак вас зовут?", reply_markup=back_cancel_kb())
     await call.answer()
 
 # Шаги записи: имя -> места -> телефон
@@ -416,7 +615,7 @@ async def step_phone(message: types.Message):
 
     # защита от дубля
     registrations = await get_registrations_by_event(event_id)
-    if any(reg[0] == message.from_user.id for reg in registrations):
+    if any(reg.user_id == message.from_user.id for reg in registrations):
         reset_user_state(message.from_user.id)
         return await message.answer("Вы уже записаны на это мероприятие.", reply_markup=main_menu_kb())
 
@@ -424,9 +623,9 @@ async def step_phone(message: types.Message):
     await add_registration(event_id, message.from_user.id, name, contact_value, seats)
 
     # уведомления админам
-    for admin_id in ADMINS:
+    for admin_id in admin_ids():
         try:
-            await bot.send_message(
+            await current_bot().send_message(
                 admin_id,
                 "💥 Новая запись на мероприятие:\n"
                 f"• Мероприятие: {st.get('event_name')}\n"
@@ -453,21 +652,19 @@ async def user_list_registrations(message: types.Message):
     user_id = message.from_user.id
     user_regs = []
     for ev in events:
-        ev_id, name, desc, dt, place = ev
-        regs = await get_registrations_by_event(ev_id)
+        regs = await get_registrations_by_event(ev.id)
         for reg in regs:
-            if reg[0] == user_id:
-                seats = reg_seats_safe(reg)
-                user_regs.append((ev_id, name, dt, place, seats))
+            if reg.user_id == user_id:
+                user_regs.append((ev, reg.seats))
 
     if not user_regs:
         return await message.answer("📭 У вас пока нет записей.", reply_markup=main_menu_kb())
 
     lines = ["Ваши записи:"]
     kb_inline = InlineKeyboardMarkup()
-    for idx, (ev_id, ev_name, ev_dt, ev_place, seats) in enumerate(user_regs, start=1):
-        lines.append(f"{idx}. {ev_name} – {iso_to_disp(ev_dt)} @ {ev_place or '(место не указано)'} — мест: {seats}")
-        kb_inline.add(InlineKeyboardButton(f"❌ Отмена {idx}", callback_data=f"{CB_CANCEL_REG}:{ev_id}"))
+    for idx, (ev, seats) in enumerate(user_regs, start=1):
+        lines.append(f"{idx}. {ev.name} – {dt_to_disp(ev.date_time)} @ {ev.place or '(место не указано)'} — мест: {seats}")
+        kb_inline.add(InlineKeyboardButton(f"❌ Отмена {idx}", callback_data=f"{CB_CANCEL_REG}:{ev.id}"))
     await message.answer("\n".join(lines), reply_markup=myregs_back_kb())
     await message.answer("Для отмены записи нажмите кнопку под соответствующим пунктом:", reply_markup=kb_inline)
 
@@ -482,24 +679,21 @@ async def cancel_registration_callback(call: types.CallbackQuery):
 
     ev = await get_event_by_id(event_id)
     regs = await get_registrations_by_event(event_id)
-    this_reg = next((r for r in regs if r[0] == user_id), None)
+    this_reg = next((r for r in regs if r.user_id == user_id), None)
 
     await delete_registration(event_id, user_id)
 
     if ev and this_reg:
-        _, ev_name, _, ev_dt, ev_place = ev[:5]
-        _, reg_name, reg_phone = this_reg[0:3]
-        seats = reg_seats_safe(this_reg)
         # уведомление админам
-        for admin_id in ADMINS:
+        for admin_id in admin_ids():
             try:
-                await bot.send_message(
+                await current_bot().send_message(
                     admin_id,
                     "❎ Отмена записи:\n"
-                    f"• Мероприятие: {ev_name} ({iso_to_disp(ev_dt)}, {ev_place or 'место не указано'})\n"
-                    f"• Имя: {reg_name}\n"
-                    f"• Телефон: {reg_phone}\n"
-                    f"• Мест: {seats}"
+                    f"• Мероприятие: {ev.name} ({dt_to_disp(ev.date_time)}, {ev.place or 'место не указано'})\n"
+                    f"• Имя: {this_reg.name}\n"
+                    f"• Телефон: {this_reg.phone}\n"
+                    f"• Мест: {this_reg.seats}"
                 )
             except Exception as e:
                 logging.warning(f"Не удалось отправить уведомление админу {admin_id}: {e}")
@@ -513,22 +707,21 @@ async def cancel_registration_callback(call: types.CallbackQuery):
     events = await get_all_events()
     still = []
     for ev2 in events:
-        e_id, name, desc, dt, place = ev2
-        rs = await get_registrations_by_event(e_id)
+        rs = await get_registrations_by_event(ev2.id)
         for r in rs:
-            if r[0] == user_id:
-                still.append((e_id, name, dt, place, reg_seats_safe(r)))
+            if r.user_id == user_id:
+                still.append((ev2, r.seats))
 
     if not still:
-        await bot.send_message(user_id, "📭 У вас пока нет записей.", reply_markup=main_menu_kb())
+        await current_bot().send_message(user_id, "📭 У вас пока нет записей.", reply_markup=main_menu_kb())
     else:
         lines = ["Ваши записи:"]
         kb_inline = InlineKeyboardMarkup()
-        for idx, (e_id, ev_name2, ev_dt2, ev_place2, seats2) in enumerate(still, start=1):
-            lines.append(f"{idx}. {ev_name2} – {iso_to_disp(ev_dt2)} @ {ev_place2 or '(место не указано)'} — мест: {seats2}")
-            kb_inline.add(InlineKeyboardButton(f"❌ Отмена {idx}", callback_data=f"{CB_CANCEL_REG}:{e_id}"))
-        await bot.send_message(user_id, "\n".join(lines), reply_markup=myregs_back_kb())
-        await bot.send_message(user_id, "Для отмены записи нажмите кнопку под соответствующим пунктом:", reply_markup=kb_inline)
+        for idx, (ev2, seats2) in enumerate(still, start=1):
+            lines.append(f"{idx}. {ev2.name} – {dt_to_disp(ev2.date_time)} @ {ev2.place or '(место не указано)'} — мест: {seats2}")
+            kb_inline.add(InlineKeyboardButton(f"❌ Отмена {idx}", callback_data=f"{CB_CANCEL_REG}:{ev2.id}"))
+        await current_bot().send_message(user_id, "\n".join(lines), reply_markup=myregs_back_kb())
+        await current_bot().send_message(user_id, "Для отмены записи нажмите кнопку под соответствующим пунктом:", reply_markup=kb_inline)
 
     await call.answer("Запись отменена.")
 
@@ -537,7 +730,7 @@ async def cancel_registration_callback(call: types.CallbackQuery):
 # -----------------------------
 @dp.message_handler(lambda m: m.text == "📋 Список участников")
 async def admin_list_participants(message: types.Message):
-    if message.from_user.id not in ADMINS:
+    if not is_admin(message.from_user.id):
         return
     events = await get_all_events()
     if not events:
@@ -545,28 +738,44 @@ async def admin_list_participants(message: types.Message):
 
     lines = ["<b>📋 Список участников на каждое мероприятие:</b>"]
     for ev in events:
-        ev_id, name, desc, dt, place = ev
-        lines.append(f"<b>{esc(name)}</b> ({iso_to_disp(dt)}, {esc(place) if place else 'место не указано'})")
-        regs = await get_registrations_by_event(ev_id)
+        lines.append(f"<b>{esc(ev.name)}</b> ({dt_to_disp(ev.date_time)}, {esc(ev.place) if ev.place else 'место не указано'})"
+                     + (" — ❌ отменено" if ev.cancelled else ""))
+        regs = await get_registrations_by_event(ev.id)
         total = 0
         if regs:
             for reg in regs:
-                _, reg_name, reg_contact = reg[0:3]
-                try:
-                    seats = int(reg[3])
-                except Exception:
-                    seats = 1
-                total += seats
-                lines.append(f"• {esc(reg_name)} — <code>{esc(reg_contact)}</code> (мест: {seats})")
+                total += reg.seats
+                lines.append(f"• {esc(reg.name)} — <code>{esc(reg.phone)}</code> (мест: {reg.seats})")
         else:
             lines.append("• (нет записей)")
         lines.append(f"Итого мест: {total}")
         lines.append("")
     await send_lines_html(message, lines, reply_markup=admin_menu_kb())
 
+@dp.message_handler(lambda m: m.text == "📊 Статистика")
+async def admin_stats(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
+    stats = await get_event_stats()
+    if not stats:
+        return await message.answer("📭 Событий пока нет.", reply_markup=admin_menu_kb())
+
+    lines = ["<b>📊 Статистика по мероприятиям:</b>"]
+    for s in stats:
+        lines.append(
+            f"<b>{esc(s.name)}</b> ({dt_to_disp(s.date_time)}): "
+            f"записей {s.reg_count}, мест {s.seats_total}, отмен {s.cancel_count}"
+        )
+    lines.append("")
+    lines.append(
+        f"Всего: записей {sum(s.reg_count for s in stats)}, мест {sum(s.seats_total for s in stats)}, "
+        f"отмен {sum(s.cancel_count for s in stats)}"
+    )
+    await send_lines_html(message, lines, reply_markup=admin_menu_kb())
+
 @dp.message_handler(lambda m: m.text == "➕ Добавить мероприятие")
 async def admin_add_event_menu(message: types.Message):
-    if message.from_user.id not in ADMINS:
+    if not is_admin(message.from_user.id):
         return
     add_states[message.from_user.id] = {'step': ADMIN_ADD_TITLE}
     await message.answer("🆕 Введите название мероприятия:", reply_markup=back_cancel_kb())
@@ -684,14 +893,14 @@ async def admin_add_description(message: types.Message):
 
 @dp.message_handler(lambda m: m.text == "❌ Удалить мероприятие")
 async def admin_delete_event_menu(message: types.Message):
-    if message.from_user.id not in ADMINS:
+    if not is_admin(message.from_user.id):
         return
     delete_states[message.from_user.id] = {'step': ADMIN_DEL_WAIT_ID}
     events = await get_all_events()
     if not events:
         delete_states.pop(message.from_user.id, None)
         return await message.answer("Нет мероприятий для удаления.", reply_markup=admin_menu_kb())
-    lst = "\n".join([f"{ev[0]}. {ev[1]} ({iso_to_disp(ev[3])})" for ev in events])
+    lst = "\n".join([f"{ev.id}. {ev.name} ({dt_to_disp(ev.date_time)})" for ev in events])
     await message.answer("Введите ID мероприятия, которое нужно удалить:\n" + lst, reply_markup=back_cancel_kb())
 
 @dp.message_handler(lambda m: delete_states.get(m.from_user.id, {}).get('step') == ADMIN_DEL_WAIT_ID)
@@ -712,9 +921,9 @@ async def admin_delete_event_get_id(message: types.Message):
     if not ev:
         return await message.answer("Событие с таким ID не найдено. Попробуйте другой ID.", reply_markup=back_cancel_kb())
 
-    delete_states[message.from_user.id] = {'step': ADMIN_DEL_CONFIRM, 'event_id': event_id, 'event_name': ev[1]}
+    delete_states[message.from_user.id] = {'step': ADMIN_DEL_CONFIRM, 'action': 'delete', 'events': [ev]}
     await message.answer(
-        f"⚠️ Удалить \"{ev[1]}\"?\nВведите **ДА** для подтверждения или любой другой текст для отмены.",
+        f"⚠️ Удалить \"{ev.name}\"?\nВведите **ДА** для подтверждения или любой другой текст для отмены.",
         parse_mode='Markdown', reply_markup=back_cancel_kb()
     )
 
@@ -734,16 +943,159 @@ async def admin_delete_event_confirm(message: types.Message):
     if message.text.strip().lower() not in ["да", "yes"]:
         return await message.answer("Удаление отменено.", reply_markup=admin_menu_kb())
 
-    event_id = st['event_id']
-    await delete_registrations_for_event(event_id)
-    await delete_event(event_id)
-    await message.answer("🗑 Готово. Мероприятие и все связанные записи удалены.", reply_markup=admin_menu_kb())
+    events = st['events']
+    if st['action'] == 'cancel':
+        texts = {
+            ev.id: f"❌ Мероприятие \"{ev.name}\" ({dt_to_disp(ev.date_time)}) отменено. Приносим извинения!"
+            for ev in events
+        }
+        broadcast_ids = await cancel_events(message.from_user.id, texts)
+        notify_new_broadcast()
+        return await message.answer(
+            f"🚫 Отменено мероприятий: {len(broadcast_ids)}. Участники получат уведомление.",
+            reply_markup=admin_menu_kb()
+        )
+
+    deleted = await delete_events([ev.id for ev in events])
+    if len(events) == 1:
+        return await message.answer("🗑 Готово. Мероприятие и все связанные записи удалены.", reply_markup=admin_menu_kb())
+    await message.answer(f"🗑 Готово. Удалено мероприятий: {deleted} (вместе с записями).", reply_markup=admin_menu_kb())
+
+@dp.message_handler(lambda m: m.text == "🗂 Массовые операции")
+async def admin_bulk_menu(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
+    await message.answer(
+        "🗂 Массовые операции (каждая выполняется целиком или не выполняется вовсе):\n"
+        "• /delete_events 3 5 7 — удалить мероприятия вместе с записями\n"
+        "• /cancel_events 3 5 — отменить и уведомить участников\n"
+        "• /clone_event 3 2025-11-01 19:00; 2025-11-08 19:00 — копии на новые даты\n"
+        "• Импорт: пришлите CSV-файл с колонками name, date_time, place, description, open_at "
+        "(время — YYYY-MM-DD HH:MM, GMT+4)",
+        reply_markup=admin_menu_kb()
+    )
+
+@dp.message_handler(content_types=[ContentType.DOCUMENT])
+async def admin_import_csv(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
+    if not (message.document.file_name or "").lower().endswith(".csv"):
+        return await message.reply("Для импорта мероприятий пришлите файл .csv")
+
+    buf = io.BytesIO()
+    await message.document.download(destination_file=buf)
+    raw = buf.getvalue()
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = raw.decode("cp1251")  # CSV из Excel
+
+    rows, errors = parse_events_csv(text)
+    if errors:
+        lines = ["❗ Импорт не выполнен, исправьте файл:"] + errors[:10]
+        if len(errors) > 10:
+            lines.append(f"... и ещё {len(errors) - 10}")
+        return await message.answer("\n".join(lines), reply_markup=admin_menu_kb())
+    if not rows:
+        return await message.answer("В файле нет мероприятий.", reply_markup=admin_menu_kb())
+
+    new_ids = await import_events(rows)
+    await message.answer(f"✅ Импортировано мероприятий: {len(new_ids)}.", reply_markup=admin_menu_kb())
+
+@dp.message_handler(lambda m: m.text == "📣 Рассылка участникам")
+async def admin_broadcast_menu(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
+    events = await get_all_events()
+    if not events:
+        return await message.answer("Нет мероприятий для рассылки.", reply_markup=admin_menu_kb())
+    broadcast_states[message.from_user.id] = {'step': ADMIN_BC_WAIT_ID}
+    lst = "\n".join([f"{ev.id}. {ev.name} ({dt_to_disp(ev.date_time)})" for ev in events])
+    await message.answer("Введите ID мероприятия, участникам которого нужно написать:\n" + lst,
+                         reply_markup=back_cancel_kb())
+
+@dp.message_handler(lambda m: broadcast_states.get(m.from_user.id, {}).get('step') == ADMIN_BC_WAIT_ID)
+async def admin_broadcast_get_id(message: types.Message):
+    if message.text == BTN_CANCEL:
+        reset_admin_states(message.from_user.id)
+        return await message.answer("Действие отменено.", reply_markup=admin_menu_kb())
+    if message.text == BTN_BACK:
+        reset_admin_states(message.from_user.id)
+        return await cmd_admin(message)
+
+    try:
+        event_id = int(message.text.strip())
+    except Exception:
+        return await message.answer("Пожалуйста, введите числовой ID мероприятия.", reply_markup=back_cancel_kb())
+
+    ev = await get_event_by_id(event_id)
+    if not ev:
+        return await message.answer("Событие с таким ID не найдено. Попробуйте другой ID.", reply_markup=back_cancel_kb())
+
+    regs = await get_registrations_by_event(event_id)
+    broadcast_states[message.from_user.id] = {
+        'step': ADMIN_BC_TEXT, 'event_id': event_id, 'event_name': ev.name, 'event_dt': ev.date_time, 'count': len(regs)
+    }
+    await message.answer(
+        f"Записей на \"{ev.name}\": {len(regs)}.\nВведите текст сообщения (например, о переносе времени или места):",
+        reply_markup=back_cancel_kb()
+    )
+
+@dp.message_handler(lambda m: broadcast_states.get(m.from_user.id, {}).get('step') == ADMIN_BC_TEXT)
+async def admin_broadcast_text(message: types.Message):
+    if message.text == BTN_CANCEL:
+        reset_admin_states(message.from_user.id)
+        return await message.answer("Действие отменено.", reply_markup=admin_menu_kb())
+    if message.text == BTN_BACK:
+        return await admin_broadcast_menu(message)
+
+    st = broadcast_states[message.from_user.id]
+    st['text'] = (
+        f"📣 Мероприятие \"{st['event_name']}\" ({dt_to_disp(st['event_dt'])}):\n"
+        f"{message.text.strip()}"
+    )
+    st['step'] = ADMIN_BC_CONFIRM
+    await message.answer(
+        f"Сообщение для {st['count']} участников:\n\n{st['text']}\n\n"
+        "Введите ДА для отправки или любой другой текст для отмены.",
+        reply_markup=back_cancel_kb()
+    )
+
+@dp.message_handler(lambda m: broadcast_states.get(m.from_user.id, {}).get('step') == ADMIN_BC_CONFIRM)
+async def admin_broadcast_confirm(message: types.Message):
+    if message.text == BTN_CANCEL:
+        reset_admin_states(message.from_user.id)
+        return await message.answer("Действие отменено.", reply_markup=admin_menu_kb())
+    if message.text == BTN_BACK:
+        broadcast_states[message.from_user.id]['step'] = ADMIN_BC_TEXT
+        return await message.answer("Введите текст сообщения:", reply_markup=back_cancel_kb())
+
+    st = broadcast_states.pop(message.from_user.id, None)
+    if not st:
+        return await message.answer("Сессия рассылки сброшена.", reply_markup=admin_menu_kb())
+
+    if message.text.strip().lower() not in ["да", "yes"]:
+        return await message.answer("Рассылка отменена.", reply_markup=admin_menu_kb())
+
+    broadcast_id = await create_broadcast(st['event_id'], message.from_user.id, st['text'])
+    notify_new_broadcast()
+    await message.answer(
+        f"📣 Рассылка #{broadcast_id} поставлена в очередь. Прогресс пришлю отдельным сообщением.",
+        reply_markup=admin_menu_kb()
+    )
 
 # -----------------------------
 # СТАРТ
 # -----------------------------
 async def on_startup(dp):
-    await init_db()
+    t0 = time.perf_counter()
+    version = await init_db()
+    asyncio.create_task(broadcast_sender(dp.bot))
+    logging.info(
+        f"Старт: импорты {IMPORTED_AT - STARTED_AT:.3f} с, "
+        f"init_db {time.perf_counter() - t0:.3f} с (схема v{version}), "
+        f"всего {time.perf_counter() - STARTED_AT:.3f} с"
+    )
     logging.info("База данных готова, бот запущен.")
 
 if __name__ == "__main__":
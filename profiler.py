@@ -0,0 +1,115 @@
+"""
+Сэмплирующий профайлер цикла событий для прода: отдельный поток раз в
+SAMPLE_INTERVAL снимает стек потока с event loop. Результат — collapsed
+stacks («a;b;c 42»), их понимают flamegraph.pl, speedscope, inferno.
+Заодно на время замера засекается каждый колбэк цикла (Handle._run) и
+записываются те, что дольше порога. Debug-режим asyncio не включаем: он
+снимает стек на каждый Handle/Task и многократно замедляет цикл — в профиле
+был бы виден он сам, а не бот.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.005   # сек. между снимками стека
+SLOW_CALLBACK = 0.1       # сек. — порог «медленного» колбэка для asyncio
+MAX_DEPTH = 128
+
+_running = threading.Lock()  # одновременно — только один замер
+_original_run = asyncio.events.Handle._run
+_slow = None  # (loop, порог, список сообщений) на время замера
+
+def _describe(handle) -> str:
+    """Колбэк цикла по-человечески: для шага задачи — её корутина и место остановки."""
+    owner = getattr(handle._callback, '__self__', None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        frame = getattr(coro, 'cr_frame', None)
+        where = f" at {os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}" if frame else ""
+        return f"<Task {owner.get_name()} {getattr(coro, '__qualname__', coro)}(){where}>"
+    return repr(handle)
+
+def _timed_run(handle):
+    """Handle._run на время замера: засекает колбэки дольше порога."""
+    t0 = time.perf_counter()
+    try:
+        _original_run(handle)
+    finally:
+        elapsed = time.perf_counter() - t0
+        slow = _slow
+        if slow is not None and elapsed >= slow[1] and handle._loop is slow[0]:
+            slow[2].append(f"Executing {_describe(handle)} took {elapsed:.3f} seconds")
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+def collapse(frame) -> str:
+    """Стек кадра -> 'корень;...;лист'."""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        if frame.f_code is not _timed_run.__code__:  # своя обёртка в профиле не нужна
+            names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class SamplingProfiler:
+    """Фоновый поток, считающий, сколько раз встретился каждый стек целевого потока."""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+                self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def hot_spots(self, top: int = 5) -> list:
+        """Самые частые листовые функции: [(имя, доля)]."""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return [(name, count / self.samples) for name, count in leaves.most_common(top)] if self.samples else []
+
+async def profile_loop(seconds: float, slow_threshold: float = SLOW_CALLBACK):
+    """
+    Профилировать текущий event loop seconds секунд.
+    Возвращает (профайлер, колбэки дольше slow_threshold) или None, если замер уже идёт.
+    """
+    global _slow
+    if not _running.acquire(blocking=False):
+        return None
+    slow = []
+    profiler = SamplingProfiler(threading.get_ident())
+    try:
+        _slow = (asyncio.get_running_loop(), slow_threshold, slow)
+        asyncio.events.Handle._run = _timed_run
+        profiler.start()
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+        asyncio.events.Handle._run = _original_run
+        _slow = None
+        _running.release()
+    return profiler, slow
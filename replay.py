@@ -0,0 +1,270 @@
+"""
+Запись и воспроизведение потока апдейтов.
+
+Запись: RECORD_UPDATES=updates.jsonl python main.py (или tenants.py)
+    каждая строка — {"t": <unix time>, "u": <Update как в Bot API>}, файл только дописывается;
+    в режиме нескольких заведений ещё "v": <имя заведения> (update_id у разных ботов пересекаются).
+
+Воспроизведение на копии базы и поддельном Bot API:
+    python replay.py updates.jsonl --db registrations.db [--realtime] [--latency 0.05] [--files DIR]
+    python replay.py updates.jsonl --tenants tenants.json ...   # копии баз и админы каждого заведения
+Печатает время и ошибки обработчиков и итоговое состояние базы (с контрольной
+суммой регистраций — удобно сравнивать версии слоя данных). Ошибка в обработчике
+не прерывает воспроизведение. Содержимое документов в запись не попадает:
+их можно положить в DIR под именем file_id, иначе скачивается пустой файл.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from tenants import Tenant, current_tenant, load_tenants
+
+def update_key(update_id: int) -> str:
+    """Ключ апдейта, уникальный среди всех заведений: 'nord/123' или '123'."""
+    tenant = current_tenant.get()
+    return f"{tenant.name}/{update_id}" if tenant else str(update_id)
+
+class UpdateRecorderMiddleware(BaseMiddleware):
+    """Дописывает каждый входящий апдейт в файл (одна строка JSON — один write)."""
+
+    def __init__(self, path: str):
+        super().__init__()
+        # O_APPEND + один os.write на строку: можно писать из нескольких воркеров
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+
+    async def on_pre_process_update(self, update, data: dict):
+        record = {'t': round(time.time(), 3), 'u': update.to_python()}
+        tenant = current_tenant.get()
+        if tenant is not None:
+            record['v'] = tenant.name
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        os.write(self.fd, (line + '\n').encode('utf-8'))
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Время работы обработчиков по именам (сообщения и callback-запросы)."""
+
+    def __init__(self):
+        super().__init__()
+        self.timings = defaultdict(list)
+        self.handler_of = {}  # update_key -> обработчик апдейта (чтобы приписать ему ошибку)
+
+    async def _start(self, data: dict):
+        data['_replay_handler'] = current_handler.get().__name__
+        data['_replay_t0'] = time.perf_counter()
+        update = types.Update.get_current()
+        if update is not None:
+            self.handler_of[update_key(update.update_id)] = data['_replay_handler']
+
+    async def _stop(self, data: dict):
+        if '_replay_t0' in data:
+            self.timings[data['_replay_handler']].append(time.perf_counter() - data['_replay_t0'])
+
+    async def on_process_message(self, message, data: dict):
+        await self._start(data)
+
+    async def on_post_process_message(self, message, results, data: dict):
+        await self._stop(data)
+
+    async def on_process_callback_query(self, call, data: dict):
+        await self._start(data)
+
+    async def on_post_process_callback_query(self, call, results, data: dict):
+        await self._stop(data)
+
+def read_recording(path: str) -> list:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+async def db_state() -> dict:
+    """Итоговое состояние базы: размеры таблиц, места по событиям, хэш регистраций."""
+    import database
+
+    state = {}
+    async with database.connect() as db:
+        for table in ('events', 'registrations', 'event_stats', 'broadcasts', 'broadcast_deliveries'):
+            cursor = await db.execute(f"SELECT COUNT(*) FROM {table}")
+            state[table] = (await cursor.fetchone())[0]
+        cursor = await db.execute(
+            "SELECT event_id, user_id, name, phone, COALESCE(seats, 1) FROM registrations "
+            "ORDER BY event_id, user_id, id"
+        )
+        digest = hashlib.sha256()
+        seats = defaultdict(int)
+        for row in await cursor.fetchall():
+            digest.update(repr(row).encode('utf-8'))
+            seats[row[0]] += row[4]
+        state['seats_by_event'] = dict(sorted(seats.items()))
+        state['registrations_sha256'] = digest.hexdigest()
+    state['event_stats_mismatches'] = len(await database.check_event_stats())
+    return state
+
+def read_files(path: str | None) -> dict:
+    """Содержимое документов для getFile: имя файла в каталоге = file_id."""
+    if not path:
+        return {}
+    files = {}
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), 'rb') as f:
+            files[name] = f.read()
+    return files
+
+def copy_db(src: str, dst: str):
+    for suffix in ("", "-wal"):  # база в WAL: незачекпойнченные записи лежат в -wal
+        if os.path.exists(src + suffix):
+            shutil.copyfile(src + suffix, dst + suffix)
+
+async def replay(records: list, realtime: bool, latency: float, files: dict, tenants: dict | None = None):
+    """
+    tenants — {имя: Tenant} для записи нескольких заведений (db_path — уже копии):
+    каждый апдейт обрабатывается с тенантом и ботом из своего поля "v".
+    """
+    import main
+    from aiogram import Bot, Dispatcher
+    from fakeapi import FakeBotAPI
+
+    api = FakeBotAPI(latency, files)
+    api.install(main.bot)
+    for tenant in (tenants or {}).values():
+        tenant.bot = Bot(token=tenant.token)
+        api.install(tenant.bot)
+    Bot.set_current(main.bot)
+    Dispatcher.set_current(main.dp)
+    timing = HandlerTimingMiddleware()
+    main.dp.middleware.setup(timing)
+    for tenant in (tenants or {None: None}).values():
+        token = current_tenant.set(tenant)
+        try:
+            await main.init_db()
+        finally:
+            current_tenant.reset(token)
+
+    # «сейчас» для обработчиков — момент записи апдейта, иначе результат зависит от даты запуска
+    recorded_now = {'t': records[0]['t'] if records else time.time()}
+    main.now_local = lambda: (
+        datetime.fromtimestamp(recorded_now['t'], tz=timezone.utc).astimezone(main.LOCAL_TZ).replace(tzinfo=None)
+    )
+
+    # (обработчик, ошибка) -> [сколько раз, первый апдейт]; как в workers.py — не прерываемся
+    errors = {}
+
+    async def process(rec):
+        recorded_now['t'] = rec['t']
+        tenant = tenants[rec['v']] if tenants and 'v' in rec else None
+        token = current_tenant.set(tenant)
+        Bot.set_current(tenant.bot if tenant else main.bot)
+        update = types.Update(**rec['u'])
+        key = update_key(update.update_id)
+        try:
+            await main.dp.process_updates([update])
+        except Exception as e:
+            handler = timing.handler_of.get(key, '(до обработчика)')
+            errors.setdefault((handler, f"{e.__class__.__name__}: {e}"), [0, key])[0] += 1
+        finally:
+            timing.handler_of.pop(key, None)
+            current_tenant.reset(token)
+
+    started = time.perf_counter()
+    if realtime:
+        # как в проде: апдейты приходят по расписанию записи и обрабатываются параллельно
+        tasks = []
+        for rec in records:
+            delay = (rec['t'] - records[0]['t']) - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(process(rec)))
+        await asyncio.gather(*tasks)
+    else:
+        # максимально быстро и детерминированно: строго по порядку
+        for rec in records:
+            await process(rec)
+    elapsed = time.perf_counter() - started
+    if not tenants:
+        return elapsed, timing.timings, errors, api.calls, await db_state()
+    state = {}
+    for name, tenant in tenants.items():
+        token = current_tenant.set(tenant)
+        try:
+            state[name] = await db_state()
+        finally:
+            current_tenant.reset(token)
+    return elapsed, timing.timings, errors, api.calls, state
+
+def print_report(count: int, elapsed: float, timings: dict, errors: dict, calls, state: dict):
+    print(f"Апдейтов: {count}, время: {elapsed:.2f} с, {count / elapsed if elapsed else 0:.1f} апдейтов/с")
+    failed_by_handler = defaultdict(int)
+    for (handler, _), (n, _) in errors.items():
+        failed_by_handler[handler] += n
+    print(f"{'обработчик':<34}{'вызовов':>8}{'ошибок':>8}{'сред, мс':>10}{'p50':>8}{'p95':>8}{'макс':>8}")
+    for name, values in sorted(timings.items(), key=lambda kv: -sum(kv[1])):
+        ms = sorted(v * 1000 for v in values)
+        p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+        print(f"{name:<34}{len(ms):>8}{failed_by_handler[name]:>8}"
+              f"{statistics.mean(ms):>10.2f}{statistics.median(ms):>8.2f}{p95:>8.2f}{ms[-1]:>8.2f}")
+    if errors:
+        print(f"Ошибки обработчиков ({sum(n for n, _ in errors.values())}):")
+        for (handler, error), (n, first_id) in sorted(errors.items(), key=lambda kv: -kv[1][0]):
+            print(f"  {handler}: {n} × {error} (первый апдейт {first_id})")
+    print("Вызовы Bot API:", dict(calls))
+    print("Состояние БД:", json.dumps(state, ensure_ascii=False, indent=2))
+
+def run_cli():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов")
+    parser.add_argument("recording")
+    parser.add_argument("--db", default="registrations.db", help="база-источник (копируется, оригинал не меняется)")
+    parser.add_argument("--tenants", help="конфиг заведений (как у tenants.py): базы каждого копируются, админы — свои")
+    parser.add_argument("--out", help="куда сохранить итоговую базу, с --tenants — каталог "
+                                      "(по умолчанию — временный каталог)")
+    parser.add_argument("--realtime", action="store_true", help="с исходными интервалами между апдейтами")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка фейкового Bot API, сек.")
+    parser.add_argument("--files", help="каталог с содержимым документов (имя файла = file_id)")
+    args = parser.parse_args()
+
+    records = read_recording(args.recording)
+    venues = sorted({rec['v'] for rec in records if 'v' in rec})
+    tenants = None
+    if args.tenants:
+        tenants = {t.name: t for t in load_tenants(args.tenants)}
+        unknown = [v for v in venues if v not in tenants]
+        if unknown:
+            parser.error(f"в конфиге {args.tenants} нет заведений: {', '.join(unknown)}")
+    elif venues:
+        parser.error(f"запись нескольких заведений ({', '.join(venues)}) — укажите --tenants")
+
+    tmp = tempfile.mkdtemp(prefix="nord-replay-")
+    out_dir = args.out or tmp
+    if tenants:
+        os.makedirs(out_dir, exist_ok=True)
+        for name, tenant in tenants.items():
+            db_copy = os.path.join(out_dir, f"{name}.db")
+            copy_db(tenant.db_path, db_copy)
+            tenants[name] = Tenant(tenant.name, tenant.token, tenant.admins, db_copy)
+        db_copy = os.path.join(tmp, "registrations.db")  # для main.py; в режиме заведений не используется
+    else:
+        db_copy = args.out or os.path.join(tmp, "registrations.db")
+        copy_db(args.db, db_copy)
+    os.environ["DB_PATH"] = db_copy
+    os.environ.setdefault("BOT_TOKEN", "123456:REPLAY")
+    os.environ.pop("RECORD_UPDATES", None)
+    try:
+        files = read_files(args.files)
+        elapsed, timings, errors, calls, state = asyncio.run(
+            replay(records, args.realtime, args.latency, files, tenants)
+        )
+        print_report(len(records), elapsed, timings, errors, calls, state)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    run_cli()
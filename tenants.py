@@ -0,0 +1,132 @@
+"""
+Несколько заведений (тенантов) в одном процессе: у каждого свой токен бота,
+свои админы и своя база. Общие на всех: HTTP-сессия к Bot API (один пул
+соединений), лимитер отправки и планировщик рассылок.
+
+Запуск:  python tenants.py tenants.json
+tenants.json:
+    [{"name": "nord", "token": "123:AAA", "admins": [21997374], "db_path": "nord.db"},
+     {"name": "port", "token": "456:BBB", "admins": [650845266], "db_path": "port.db"}]
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+from collections.abc import MutableMapping
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+import aiohttp
+from aiogram import Bot
+
+POLL_TIMEOUT = 20  # long polling getUpdates, сек.
+
+@dataclass(slots=True)
+class Tenant:
+    name: str
+    token: str
+    admins: list
+    db_path: str
+    bot: Bot | None = None
+
+# тенант обрабатываемого апдейта; None — обычный режим с одним ботом (main.py)
+current_tenant: ContextVar[Tenant | None] = ContextVar('current_tenant', default=None)
+
+class TenantState(MutableMapping):
+    """
+    dict состояний, раздельный для каждого тенанта: один и тот же user_id
+    в ботах двух заведений — это два независимых диалога.
+    """
+
+    def __init__(self):
+        self._by_tenant = {}
+
+    def _current(self) -> dict:
+        tenant = current_tenant.get()
+        return self._by_tenant.setdefault(tenant.name if tenant else None, {})
+
+    def __getitem__(self, key):
+        return self._current()[key]
+
+    def __setitem__(self, key, value):
+        self._current()[key] = value
+
+    def __delitem__(self, key):
+        del self._current()[key]
+
+    def __iter__(self):
+        return iter(self._current())
+
+    def __len__(self):
+        return len(self._current())
+
+class SharedSessionBot(Bot):
+    """Bot, использующий общую HTTP-сессию (один пул соединений на все тенанты)."""
+    _shared_session: aiohttp.ClientSession | None = None
+
+    async def get_new_session(self) -> aiohttp.ClientSession:
+        cls = SharedSessionBot
+        if cls._shared_session is None or cls._shared_session.closed:
+            cls._shared_session = await super().get_new_session()
+        return cls._shared_session
+
+def load_tenants(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return [Tenant(d['name'], d['token'], [int(a) for a in d.get('admins', [])], d['db_path']) for d in data]
+
+async def _process(tenant: Tenant, dp, update):
+    # контекст задачи — копия, поэтому тенант/бот видны только этому апдейту
+    current_tenant.set(tenant)
+    Bot.set_current(tenant.bot)
+    try:
+        await dp.process_updates([update])
+    except Exception:
+        logging.exception(f"[{tenant.name}] ошибка обработки апдейта {update.update_id}")
+
+async def _poll(tenant: Tenant, dp):
+    offset = None
+    while True:
+        try:
+            updates = await tenant.bot.get_updates(offset=offset, timeout=POLL_TIMEOUT)
+        except Exception as e:
+            logging.warning(f"[{tenant.name}] ошибка getUpdates: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            asyncio.create_task(_process(tenant, dp, update))
+
+async def run(tenants: list):
+    import main  # регистрирует хендлеры на main.dp
+    import broadcast
+
+    for tenant in tenants:
+        tenant.bot = SharedSessionBot(token=tenant.token)
+        token = current_tenant.set(tenant)
+        try:
+            await main.init_db()
+        finally:
+            current_tenant.reset(token)
+    asyncio.create_task(broadcast.broadcast_scheduler([(t, t.bot) for t in tenants]))
+    logging.info(f"Базы данных готовы, ботов запущено: {len(tenants)} ({', '.join(t.name for t in tenants)}).")
+    try:
+        await asyncio.gather(*(_poll(t, main.dp) for t in tenants))
+    finally:
+        if SharedSessionBot._shared_session is not None:
+            await SharedSessionBot._shared_session.close()
+
+if __name__ == "__main__":
+    # работаем через импортированный модуль: иначе этот файл загрузится дважды (__main__ и tenants),
+    # и current_tenant, который читают database/main/broadcast, окажется другим ContextVar
+    import tenants
+
+    configs = tenants.load_tenants(sys.argv[1] if len(sys.argv) > 1 else "tenants.json")
+    # main.py создаёт свой Bot при импорте — в этом режиме он не используется
+    os.environ.setdefault("BOT_TOKEN", configs[0].token)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(tenants.run(configs))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,271 @@
+"""
+Многопроцессный режим: один процесс получает апдейты (long polling) и
+раскладывает их по N воркерам. Маршрутизация липкая по user_id, поэтому
+диалог пользователя (user_states, add_states, ...) всегда живёт в одном
+воркере, а его апдейты обрабатываются строго по порядку.
+
+Все записи в БД (функции database.py с @writes) воркеры и главный процесс
+пересылают одному процессу-писателю: он выполняет их по одной на долгоживущем
+соединении, так что воркеры не соревнуются за блокировку SQLite. Чтения
+остаются в воркерах (WAL: читатели не мешают писателю).
+
+Запуск:  python workers.py --workers 4
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import multiprocessing as mp
+import pickle
+import time
+
+# ключи апдейта, у которых есть отправитель (from/user) или чат
+UPDATE_KINDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+    'shipping_query', 'pre_checkout_query', 'poll_answer', 'my_chat_member', 'chat_member',
+    'chat_join_request', 'channel_post', 'edited_channel_post',
+)
+POLL_TIMEOUT = 20     # long polling getUpdates, сек.
+BROADCAST_POLL = 5    # рассылки ставят воркеры — главный процесс проверяет очередь чаще
+# записи в БД из обработчиков, которые замеряет нагрузочный тест (loadtest.py)
+TIMED_WRITES = ('add_registration', 'delete_registration')
+
+def route_key(raw: dict) -> int:
+    """ID пользователя (или чата) апдейта — ключ липкой маршрутизации."""
+    for kind in UPDATE_KINDS:
+        obj = raw.get(kind)
+        if not obj:
+            continue
+        user = obj.get('from') or obj.get('user')
+        if user:
+            return int(user['id'])
+        chat = obj.get('chat')
+        if chat:
+            return int(chat['id'])
+    return int(raw.get('update_id', 0))
+
+class WriteProxy:
+    """database.write_hook процесса: отправляет записи писателю и ждёт ответ."""
+
+    def __init__(self, index: int, requests, replies):
+        self.index = index
+        self.requests = requests
+        self.replies = replies
+        self._ids = itertools.count()
+        self._waiting = {}
+        self._reader = None
+
+    async def __call__(self, name: str, args, kwargs):
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read_replies())
+        req_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[req_id] = future
+        self.requests.put((self.index, req_id, name, args, kwargs))
+        return await future
+
+    async def _read_replies(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            reply = await loop.run_in_executor(None, self.replies.get)
+            if reply is None:
+                break
+            req_id, ok, value = reply
+            future = self._waiting.pop(req_id)
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def close(self):
+        """Остановить чтение ответов (иначе поток executor не даст завершиться asyncio.run)."""
+        if self._reader is not None:
+            self.replies.put(None)
+            await self._reader
+
+async def _answer(writer, replies, request):
+    index, req_id, name, args, kwargs = request
+    try:
+        reply = (req_id, True, await writer(name, args, kwargs))
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = RuntimeError(f"{name}: {e!r}")
+        reply = (req_id, False, e)
+    replies[index].put(reply)
+
+async def _writer_loop(requests, replies):
+    import database
+
+    writer = database.SerialWriter()
+    loop = asyncio.get_running_loop()
+    running = set()
+    while True:
+        request = await loop.run_in_executor(None, requests.get)
+        if request is None:
+            break
+        # задачи встают в очередь к блокировке SerialWriter в порядке поступления
+        task = asyncio.create_task(_answer(writer, replies, request))
+        running.add(task)
+        task.add_done_callback(running.discard)
+    if running:
+        await asyncio.wait(running)
+    await writer.close()
+
+def writer_main(requests, replies):
+    """Точка входа процесса-писателя."""
+    asyncio.run(_writer_loop(requests, replies))
+
+def _time_writes(module, names, timings: list):
+    """Обернуть функции записи в БД замером времени — вместе с очередью к писателю."""
+    for name in names:
+        func = getattr(module, name)
+
+        async def timed(*args, _func=func, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await _func(*args, **kwargs)
+            finally:
+                timings.append(time.perf_counter() - t0)
+
+        setattr(module, name, timed)
+
+async def _worker_loop(index: int, queue, requests, replies, done_queue, fake_latency):
+    import main  # регистрирует хендлеры на main.dp
+    import database
+    from aiogram import Bot, Dispatcher, types
+
+    proxy = database.write_hook = WriteProxy(index, requests, replies)
+
+    if fake_latency is not None:
+        from fakeapi import FakeBotAPI
+        FakeBotAPI(fake_latency).install(main.bot)
+    Bot.set_current(main.bot)
+    Dispatcher.set_current(main.dp)
+
+    write_times = []
+    if done_queue is not None:
+        _time_writes(main, TIMED_WRITES, write_times)
+
+    loop = asyncio.get_running_loop()
+    tails = {}       # ключ -> последняя задача пользователя (сохраняем порядок апдейтов)
+    running = set()
+    processed = failed = 0
+
+    async def handle(key, prev, raw):
+        nonlocal processed, failed
+        if prev is not None:
+            await asyncio.wait({prev})
+        try:
+            await main.dp.process_updates([types.Update(**raw)])
+        except Exception:
+            failed += 1
+            logging.exception(f"Воркер {index}: ошибка обработки апдейта {raw.get('update_id')}")
+        processed += 1
+        if tails.get(key) is asyncio.current_task():
+            del tails[key]
+
+    if done_queue is not None:
+        done_queue.put(('ready', index))
+    while True:
+        raw = await loop.run_in_executor(None, queue.get)
+        if raw is None:
+            break
+        key = route_key(raw)
+        task = asyncio.create_task(handle(key, tails.get(key), raw))
+        tails[key] = task
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+    if running:
+        await asyncio.wait(running)
+    await proxy.close()
+    await (await main.bot.get_session()).close()
+    if done_queue is not None:
+        done_queue.put(('done', index, processed, failed, write_times))
+
+def worker_main(index: int, queue, requests, replies, done_queue=None, fake_latency=None):
+    """Точка входа процесса-воркера."""
+    asyncio.run(_worker_loop(index, queue, requests, replies, done_queue, fake_latency))
+
+def start_workers(count: int, done_queue=None, fake_latency=None):
+    """
+    Запустить процесс-писатель и count воркеров.
+    Возвращает (процессы воркеров, их очереди, писатель); писатель — (процесс,
+    очередь запросов, очереди ответов), ответы с индексом count — для главного процесса.
+    """
+    ctx = mp.get_context('spawn')
+    requests = ctx.Queue()
+    replies = [ctx.Queue() for _ in range(count + 1)]
+    writer = ctx.Process(target=writer_main, args=(requests, replies), name="bot-writer", daemon=True)
+    writer.start()
+
+    queues = [ctx.Queue() for _ in range(count)]
+    procs = [
+        ctx.Process(target=worker_main, args=(i, queues[i], requests, replies[i], done_queue, fake_latency),
+                    name=f"bot-worker-{i}", daemon=True)
+        for i in range(count)
+    ]
+    for p in procs:
+        p.start()
+    return procs, queues, (writer, requests, replies)
+
+def stop_workers(procs, queues, writer=None, timeout: float = 30):
+    """Остановить воркеров, затем писателя — после того как воркеры дописали своё."""
+    for q in queues:
+        q.put(None)
+    for p in procs:
+        p.join(timeout)
+    if writer is not None:
+        proc, requests, _ = writer
+        requests.put(None)
+        proc.join(timeout)
+
+def dispatch(raw: dict, queues):
+    queues[route_key(raw) % len(queues)].put(raw)
+
+async def _poll(queues, writer):
+    import main
+    import broadcast
+    import database
+
+    await main.init_db()
+    # записи отправщика рассылок тоже идут через писателя
+    _, requests, replies = writer
+    proxy = database.write_hook = WriteProxy(len(queues), requests, replies[len(queues)])
+    # рассылки шлёт только главный процесс: один общий лимит отправки на бота
+    broadcast.IDLE_POLL = BROADCAST_POLL
+    asyncio.create_task(broadcast.broadcast_sender(main.bot))
+    logging.info(f"База данных готова, бот запущен ({len(queues)} воркеров).")
+
+    offset = None
+    try:
+        while True:
+            try:
+                updates = await main.bot.get_updates(offset=offset, timeout=POLL_TIMEOUT)
+            except Exception as e:
+                logging.warning(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                dispatch(update.to_python(), queues)
+    finally:
+        await proxy.close()
+
+def run(workers: int):
+    procs, queues, writer = start_workers(workers)
+    try:
+        asyncio.run(_poll(queues, writer))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_workers(procs, queues, writer)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NORD bot: несколько процессов-воркеров")
+    parser.add_argument("--workers", type=int, default=max(1, mp.cpu_count() - 1))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    run(args.workers)